@@ -1,16 +1,31 @@
+import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
 import logging
 
 
 class AdminPanel:
-    def __init__(self, database):
+    def __init__(self, database, file_cache=None, broadcaster=None, membership=None):
         self.db = database
+        self.file_cache = file_cache
+        self.broadcaster = broadcaster
+        self.membership = membership
         self.admin_ids = [int(id.strip()) for id in os.environ.get('ADMIN_IDS', '').split(',') if id.strip()]
+        self.state_ttl = int(os.environ.get('CONVERSATION_STATE_TTL', 3600))
 
     def is_admin(self, user_id):
         return user_id in self.admin_ids
 
+    # وضعیت گفتگو در دیتابیس نگه داشته می‌شود تا پیام بعدی ادمین روی هر نمونه‌ای از ربات برسد
+    async def get_state(self, user_id):
+        return await self.db.get_conversation_state(user_id, self.state_ttl)
+
+    async def set_state(self, user_id, state):
+        await self.db.set_conversation_state(user_id, state)
+
+    async def clear_state(self, user_id):
+        await self.db.clear_conversation_state(user_id)
+
     async def show_admin_panel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
 
@@ -23,6 +38,7 @@ class AdminPanel:
             [InlineKeyboardButton("➕ افزودن کانال اجباری", callback_data="admin_add_channel")],
             [InlineKeyboardButton("📢 ارسال پیام همگانی", callback_data="admin_broadcast")],
             [InlineKeyboardButton("📋 لیست کانال‌های اجباری", callback_data="admin_list_channels")],
+            [InlineKeyboardButton("🗑️ پاکسازی کش فایل‌ها", callback_data="admin_clear_cache")],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -51,26 +67,67 @@ class AdminPanel:
             await self.list_forced_channels(query)
         elif data == "admin_broadcast":
             await self.request_broadcast_message(query)
+        elif data == "admin_clear_cache":
+            await self.clear_file_cache(query)
 
     async def show_statistics(self, query):
-        stats = self.db.get_statistics()
-        channels = self.db.get_forced_channels()
+        stats = await self.db.get_statistics()
+        channels = await self.db.get_forced_channels()
 
         text = f"""
 📊 **آمار ربات**
 
 👥 تعداد کاربران: `{stats['total_users']}`
 📥 تعداد دانلودها: `{stats['total_downloads']}`
+💾 حجم کل ارسال شده: `{stats['total_bytes'] / (1024 * 1024):.1f} MB`
 📋 کانال‌های اجباری: `{len(channels)}`
 
 🆔 ادمین‌ها: `{', '.join(map(str, self.admin_ids))}`
         """
 
+        if stats['platforms']:
+            text += "\n⏱️ **۲۴ ساعت اخیر**\n"
+            for row in stats['platforms']:
+                # توان عملیاتی: حجم تقسیم بر مجموع زمان درخواست‌های موفق
+                seconds = row['duration_ms'] / 1000
+                throughput = (row['bytes'] / (1024 * 1024) / seconds) if seconds else 0
+                text += (
+                    f"• {row['platform']}: ✅ `{row['success']}` ❌ `{row['failed']}` "
+                    f"⚡ کش `{row['cache_hits']}` 🚀 `{throughput:.2f} MB/s`\n"
+                )
+
+        if stats['daily']:
+            text += "\n📈 **روند ۷ روز اخیر**\n"
+            for day, downloads in stats['daily']:
+                text += f"• {day}: `{downloads}`\n"
+
+        if self.file_cache:
+            cache = self.file_cache.stats()
+            text += f"""
+🗂️ **کش فایل‌ها**
+📦 آیتم‌های حافظه: `{cache['size']}`
+⚡ برخورد حافظه: `{cache['memory_hits']}` | دیتابیس: `{cache['db_hits']}`
+🐢 عدم برخورد: `{cache['misses']}`
+🎯 نرخ برخورد: `{cache['hit_rate']:.1f}%`
+            """
+
         keyboard = [[InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+    async def clear_file_cache(self, query):
+        if self.file_cache:
+            await self.file_cache.invalidate()
+            text = "✅ کش فایل‌ها پاکسازی شد"
+        else:
+            text = "❌ کش فایل‌ها فعال نیست"
+
+        keyboard = [[InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
     async def request_channel_info(self, query):
         await query.edit_message_text(
             "📝 لطفا اطلاعات کانال را به فرمت زیر ارسال کنید:\n\n"
@@ -79,10 +136,10 @@ class AdminPanel:
             parse_mode='Markdown'
         )
         # ذخیره وضعیت برای دریافت اطلاعات کانال
-        context.user_data['waiting_for_channel'] = True
+        await self.set_state(query.from_user.id, 'waiting_for_channel')
 
     async def list_forced_channels(self, query):
-        channels = self.db.get_forced_channels()
+        channels = await self.db.get_forced_channels()
 
         if not channels:
             text = "📭 هیچ کانال اجباری تنظیم نشده است"
@@ -102,7 +159,7 @@ class AdminPanel:
             "برای لغو /cancel را ارسال کنید"
         )
         # ذخیره وضعیت برای دریافت پیام همگانی
-        context.user_data['waiting_for_broadcast'] = True
+        await self.set_state(query.from_user.id, 'waiting_for_broadcast')
 
     async def process_channel_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -113,59 +170,52 @@ class AdminPanel:
 
         # بررسی فرمت
         if channel_input.startswith('@'):
-            channel_username = channel_input
-            channel_id = None  # نیاز به دریافت ID از طریق API
+            chat_ref = channel_input
         elif channel_input.startswith('-100'):
-            channel_id = int(channel_input)
-            channel_username = None
+            chat_ref = int(channel_input)
         else:
             await update.message.reply_text("❌ فرمت نامعتبر. لطفا از @channel_username یا -1001234567890 استفاده کنید")
             return
 
-        # در اینجا باید با API تلگرام اطلاعات کانال را دریافت کنید
-        # برای سادگی، فرض می‌کنیم اطلاعات را داریم
+        # دریافت شناسه و عنوان واقعی کانال از API تلگرام (برای بررسی عضویت لازم است)
+        try:
+            chat = await context.bot.get_chat(chat_ref)
+        except Exception as e:
+            logging.error(f"Channel lookup error for {chat_ref}: {e}")
+            await update.message.reply_text("❌ کانال پیدا نشد. مطمئن شوید ربات در کانال ادمین است")
+            return
 
-        success = self.db.add_forced_channel(channel_id or 0, channel_username, "کانال تست")
+        channel_username = f"@{chat.username}" if chat.username else None
+        success = await self.db.add_forced_channel(chat.id, channel_username, chat.title)
 
         if success:
+            # نتایج عضویت کش شده دیگر معتبر نیستند
+            if self.membership:
+                self.membership.invalidate()
             await update.message.reply_text("✅ کانال با موفقیت اضافه شد")
         else:
             await update.message.reply_text("❌ خطا در افزودن کانال")
 
-        context.user_data.pop('waiting_for_channel', None)
+        await self.clear_state(user_id)
 
     async def process_broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if not self.is_admin(user_id):
             return
 
-        message = update.message
-        user_ids = self.db.get_all_users()
-
-        success_count = 0
-        fail_count = 0
-
-        await update.message.reply_text(f"🚀 شروع ارسال پیام همگانی به {len(user_ids)} کاربر...")
-
-        for uid in user_ids:
-            try:
-                if message.text:
-                    await context.bot.send_message(chat_id=uid, text=message.text)
-                elif message.caption:
-                    if message.photo:
-                        await context.bot.send_photo(chat_id=uid, photo=message.photo[-1].file_id,
-                                                     caption=message.caption)
-                    elif message.video:
-                        await context.bot.send_video(chat_id=uid, video=message.video.file_id, caption=message.caption)
-                success_count += 1
-            except Exception as e:
-                logging.error(f"Broadcast error for user {uid}: {e}")
-                fail_count += 1
+        await self.clear_state(user_id)
 
-        await update.message.reply_text(
-            f"📊 نتیجه ارسال همگانی:\n\n"
-            f"✅ موفق: {success_count}\n"
-            f"❌ ناموفق: {fail_count}"
+        if not self.broadcaster:
+            await update.message.reply_text("❌ ارسال همگانی در حال حاضر در دسترس نیست")
+            return
+
+        # ارسال در پس‌زمینه انجام می‌شود و پیشرفت آن به صورت زنده در یک پیام گزارش می‌شود
+        job = await self.broadcaster.start(
+            context.bot,
+            admin_chat_id=update.effective_chat.id,
+            from_chat_id=update.effective_chat.id,
+            message_id=update.message.message_id
         )
 
-        context.user_data.pop('waiting_for_broadcast', None)
\ No newline at end of file
+        if not job:
+            await update.message.reply_text("❌ خطا در ایجاد ارسال همگانی")
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from metrics import BANDWIDTH_ALLOCATED
+
+
+class BandwidthShare:
+    def __init__(self, weight, since):
+        self.weight = weight
+        self.since = since  # زمان ورود کار به صف (monotonic) برای وزن سن
+        self.rate = 0  # سهم فعلی بایت بر ثانیه؛ صفر یعنی بدون محدودیت
+        self.demand = float('inf')  # اگر منبع کندتر از سهم باشد، نرخ مشاهده شده آن
+        self.next_time = time.monotonic()
+        self.files = {}  # filename -> بایت‌های گزارش شده تا کنون
+        self.window_bytes = 0
+        self.window_started = None
+        self.throttled = False
+
+
+class BandwidthScheduler:
+    """تقسیم ظرفیت لینک (DOWNLOAD_BANDWIDTH بایت بر ثانیه) بین دانلودهای فعال
+
+    سهم هر کار به نسبت وزنش است: اولویت ادمین و سن کار در صف (هر BANDWIDTH_AGE_STEP ثانیه یک واحد).
+    کاری که منبعش کندتر از سهمش است فقط به اندازه نیازش می‌گیرد و باقی بین بقیه پخش می‌شود (water-filling)
+    تا ظرفیت هدر نرود. محدودیت با progress hook های yt-dlp در thread دانلود اعمال می‌شود.
+    """
+
+    def __init__(self):
+        self.capacity = int(os.environ.get('DOWNLOAD_BANDWIDTH', 0))
+        self.priority_weight = float(os.environ.get('BANDWIDTH_PRIORITY_WEIGHT', 4))
+        self.age_step = float(os.environ.get('BANDWIDTH_AGE_STEP', 60))
+        self.rebalance_interval = float(os.environ.get('BANDWIDTH_REBALANCE_INTERVAL', 1))
+        # حداکثر بایتی که یک کار پس از مدتی بیکاری می‌تواند یک‌باره بگیرد (بر حسب ثانیه از سهمش)
+        self.burst = float(os.environ.get('BANDWIDTH_BURST', 0.5))
+        # کف سهم هر کار تا تخمین اشتباه نیاز، دانلودی را عملا متوقف نکند
+        self.min_rate = max(1, self.capacity // 20)
+
+        self.lock = threading.Lock()
+        self.shares = []
+        self.next_rebalance = 0
+        BANDWIDTH_ALLOCATED.set_function(lambda: sum(share.rate for share in self.shares))
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    @contextmanager
+    def share(self, priority=False, waited=0):
+        """ثبت یک دانلود فعال؛ خروجی progress hook برای YoutubeDL"""
+        share = BandwidthShare(self.priority_weight if priority else 1, time.monotonic() - waited)
+        with self.lock:
+            self.shares.append(share)
+            self.rebalance()
+        try:
+            yield lambda status: self.throttle(share, status)
+        finally:
+            with self.lock:
+                self.shares.remove(share)
+                self.rebalance()
+
+    def weight(self, share, now):
+        return share.weight * (1 + (now - share.since) / self.age_step)
+
+    def rebalance(self):
+        """محاسبه سهم هر کار با water-filling؛ باید با lock صدا زده شود"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self.next_rebalance = now + self.rebalance_interval
+
+        weights = {id(share): self.weight(share, now) for share in self.shares}
+        remaining = self.capacity
+        total = sum(weights.values())
+        # کارهایی که نیاز کمتری نسبت به وزنشان دارند اول سیر می‌شوند
+        for share in sorted(self.shares, key=lambda share: share.demand / weights[id(share)]):
+            fair = remaining * weights[id(share)] / total if total else remaining
+            share.rate = max(self.min_rate, int(min(fair, share.demand)))
+            remaining -= share.rate
+            total -= weights[id(share)]
+
+    def throttle(self, share, status):
+        if not self.enabled or status.get('status') != 'downloading':
+            return
+
+        filename = status.get('filename') or status.get('tmpfilename')
+        downloaded = status.get('downloaded_bytes') or 0
+        with self.lock:
+            # هر فایل (مثلا ویدیو و صدای جدا) شمارنده خودش را دارد؛ ادامه دانلود از نیمه هم از صفر شروع نمی‌شود
+            previous = share.files.get(filename)
+            share.files[filename] = downloaded
+            delta = downloaded - previous if previous is not None and downloaded >= previous else 0
+
+            now = time.monotonic()
+            share.window_bytes += delta
+            if share.window_started is None:
+                share.window_started = now
+            elif now - share.window_started >= self.rebalance_interval:
+                observed = share.window_bytes / (now - share.window_started)
+                # اگر در این بازه محدود نشده و کمتر از سهمش گرفته، گلوگاه منبع است نه سهم
+                limited = not share.throttled and observed < share.rate * 0.9
+                share.demand = max(observed * 1.25, self.min_rate) if limited else float('inf')
+                share.window_bytes, share.window_started, share.throttled = 0, now, False
+            if now >= self.next_rebalance:
+                self.rebalance()
+
+            share.next_time = max(share.next_time, now - self.burst) + delta / share.rate
+            delay = share.next_time - now
+            if delay > 0:
+                share.throttled = True
+
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,80 @@
+"""مقایسه سربار هر درخواست: ساخت YoutubeDL جدید در برابر استخر ydl_pool
+
+اجرا از ریشه پروژه:
+    python benchmarks/bench_ydl_pool.py [iterations]
+
+یک سرور HTTP محلی فایل مصنوعی سرو می‌کند تا نتیجه به شبکه بستگی نداشته باشد.
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import subprocess
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ydl_pool import YoutubeDLPool, load_yt_dlp
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(label, iterations, func):
+    func()  # گرم کردن
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = (time.perf_counter() - start) / iterations * 1000
+    print(f"{label:<28} {elapsed:8.2f} ms/request")
+    return elapsed
+
+
+def import_time():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import yt_dlp'], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'clip.mp4'), 'wb') as file:
+            file.write(os.urandom(64 * 1024))
+        server = serve(directory)
+        url = f"http://127.0.0.1:{server.server_port}/clip.mp4"
+
+        yt_dlp = load_yt_dlp()
+
+        def fresh():
+            with yt_dlp.YoutubeDL({'quiet': True, 'noplaylist': True}) as ydl:
+                ydl.extract_info(url, download=False)
+
+        pool = YoutubeDLPool()
+
+        def pooled():
+            with pool.lease('generic') as ydl:
+                ydl.extract_info(url, download=False)
+
+        print(f"python -c 'import yt_dlp'      {import_time():8.2f} ms (cold process)")
+        before = measure("fresh YoutubeDL per request", iterations, fresh)
+        after = measure("pooled YoutubeDL", iterations, pooled)
+        print(f"speedup                      {before / after:8.2f}x")
+
+        pool.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+"""تست بار آفلاین ربات: هندلرهای واقعی Application در برابر Bot API ساختگی و extractor ساختگی
+
+اجرا از ریشه پروژه:
+    python benchmarks/load_test.py --updates 500 --concurrency 50 --media-size 2000000
+
+- سرور Bot API ساختگی متدهای sendMessage، sendDocument، editMessageText و ... را با تاخیر
+  قابل تنظیم (--api-latency) و پاسخ 429 تصادفی (--rate-limit-ratio) جواب می‌دهد.
+- extractor ساختگی yt-dlp لینک‌های یوتیوب و اینستاگرام را به فایل مصنوعی با حجم --media-size
+  روی یک سرور HTTP محلی نگاشت می‌کند؛ بقیه مسیر دانلود (probe، انتخاب فرمت، دانلود) واقعی است.
+- با --local-mode ربات در حالت سرور Bot API محلی اجرا می‌شود و سرور ساختگی به جای بدنه فایل،
+  مسیر file:// را می‌گیرد و حجم را از دیسک می‌خواند.
+- لینک‌های اینستاگرام (نوع carousel در --mix) پست چندتایی با --carousel-size عضو (اولی عکس و
+  بقیه ویدیو) هستند که در sendMediaGroup ارسال می‌شوند.
+- مولد بار ترکیبی از /start، متن بدون لینک، لینک جدید و لینک تکراری (کش و ادغام) را با
+  حداکثر --concurrency آپدیت هم‌زمان پردازش می‌کند و updates/s، p50/p95/p99 و حافظه را گزارش می‌دهد.
+
+اگر DATABASE_URL تنظیم نشده باشد ربات در حالت محدود (بدون دیتابیس) اجرا می‌شود.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import string
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs, unquote, urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOT_TOKEN = '123456:BENCHMARK'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def read_body(handler, keep=None):
+    """خواندن بدنه درخواست، چه با Content-Length و چه chunked؛ خروجی (body, length)
+
+    با keep فقط همان تعداد بایت اول نگه داشته می‌شود تا حافظه سرور ساختگی در گزارش RSS ربات اثر نگذارد.
+    """
+    def pieces():
+        if 'chunked' in (handler.headers.get('Transfer-Encoding') or '').lower():
+            while True:
+                size = int(handler.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    handler.rfile.readline()
+                    return
+                while size:
+                    piece = handler.rfile.read(min(size, 65536))
+                    size -= len(piece)
+                    yield piece
+                handler.rfile.readline()
+        remaining = int(handler.headers.get('Content-Length') or 0)
+        while remaining:
+            piece = handler.rfile.read(min(remaining, 65536))
+            if not piece:
+                return
+            remaining -= len(piece)
+            yield piece
+
+    body, length = bytearray(), 0
+    for piece in pieces():
+        length += len(piece)
+        if keep is None or len(body) < keep:
+            body += piece
+    return bytes(body), length
+
+
+def request_params(content_type, body):
+    """پارامترهای ساده (غیر فایل) درخواست Bot API"""
+    if content_type.startswith('multipart/form-data'):
+        # فقط فیلدهای متنی کوچک لازم است؛ محتوای فایل نادیده گرفته می‌شود
+        fields = re.findall(rb'name="([^"]+)"\r\n\r\n(.{0,256}?)\r\n--', body, re.DOTALL)
+        return {name.decode(): value.decode('utf-8', 'replace') for name, value in fields}
+    if content_type.startswith('application/json'):
+        return {key: str(value) for key, value in json.loads(body or b'{}').items()}
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+class FakeBotAPI:
+    """سرور Bot API ساختگی با تاخیر و خطای 429 قابل تنظیم"""
+
+    def __init__(self, latency=0.0, rate_limit_ratio=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.message_id = 0
+        self.calls = defaultdict(int)
+        self.rate_limited = 0
+        self.uploaded_bytes = 0
+        self.server = None
+
+    def next_message_id(self):
+        with self.lock:
+            self.message_id += 1
+            return self.message_id
+
+    def message(self, params, **extra):
+        chat_id = int(params.get('chat_id') or 0)
+        message = {
+            'message_id': self.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        message.update(extra)
+        return message
+
+    def media_message(self, params, kind='document'):
+        message_id = self.next_message_id()
+        file = {'file_id': f'BENCH{message_id}', 'file_unique_id': f'bench{message_id}'}
+        if kind == 'photo':
+            return self.message(params, photo=[{**file, 'width': 1080, 'height': 1080}])
+        if kind == 'video':
+            return self.message(params, video={**file, 'width': 640, 'height': 360, 'duration': 60})
+        return self.message(params, document={**file, 'file_name': 'media.mp4'})
+
+    def respond(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText'):
+            return self.message(params)
+        if method in ('sendDocument', 'sendPhoto', 'sendVideo'):
+            return self.media_message(params, method[len('send'):].lower())
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media') or '[]')
+            return [self.media_message(params, item.get('type')) for item in media]
+        if method == 'copyMessage':
+            return {'message_id': self.next_message_id()}
+        if method == 'getChatMember':
+            return {'status': 'member', 'user': {'id': int(params.get('user_id') or 0), 'is_bot': False,
+                                                 'first_name': 'user'}}
+        if method == 'getChat':
+            return {'id': -100, 'type': 'channel', 'title': 'bench'}
+        # deleteMessage، answerCallbackQuery، setWebhook و ...
+        return True
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                upload = method in ('sendDocument', 'sendPhoto', 'sendVideo', 'sendMediaGroup')
+                # فیلدهای متنی multipart پیش از فایل‌ها می‌آیند
+                body, length = read_body(self, keep=65536 if upload else None)
+                params = request_params(self.headers.get('Content-Type') or '', body)
+                if params.get('document', '').startswith('file://'):
+                    length = os.path.getsize(unquote(urlparse(params['document']).path))
+                if method == 'sendMediaGroup' and 'file://' in params.get('media', ''):
+                    length = sum(os.path.getsize(unquote(urlparse(item['media']).path))
+                                 for item in json.loads(params['media']) if item['media'].startswith('file://'))
+
+                with api.lock:
+                    api.calls[method] += 1
+                    if upload:
+                        api.uploaded_bytes += length
+                    limited = method != 'getMe' and api.random.random() < api.rate_limit_ratio
+                    if limited:
+                        api.rate_limited += 1
+
+                if api.latency:
+                    time.sleep(api.latency)
+
+                if limited:
+                    status, payload = 429, {
+                        'ok': False, 'error_code': 429,
+                        'description': f'Too Many Requests: retry after {api.retry_after}',
+                        'parameters': {'retry_after': api.retry_after},
+                    }
+                else:
+                    status, payload = 200, {'ok': True, 'result': api.respond(method, params)}
+
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """فایل مصنوعی با حجم ثابت، بدون نوشتن روی دیسک"""
+    protocol_version = 'HTTP/1.1'
+    media_size = 1024 * 1024
+    chunk = b'\0' * 65536
+
+    def log_message(self, *args):
+        pass
+
+    def send_headers(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(self.media_size))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_headers()
+
+    def do_GET(self):
+        self.send_headers()
+        remaining = self.media_size
+        while remaining > 0:
+            part = self.chunk[:remaining]
+            self.wfile.write(part)
+            remaining -= len(part)
+
+
+def serve_media(size):
+    handler = type('SizedMediaHandler', (MediaHandler,), {'media_size': size})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install_fake_extractor(media_url, media_size, probe_latency, carousel_size=1):
+    """extractor ساختگی را در ابتدای لیست extractorهای هر نمونه استخر قرار می‌دهد"""
+    from ydl_pool import YoutubeDLPool, load_yt_dlp
+    load_yt_dlp()
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class FakeMediaIE(InfoExtractor):
+        IE_NAME = 'benchmark'
+        _VALID_URL = (r'https?://(?:www\.)?(?:youtube\.com/watch\?v=|instagram\.com/(?:p|reel|tv)/)'
+                      r'(?P<id>[\w-]+)')
+
+        def _real_extract(self, url):
+            media_id = self._match_id(url)
+            if probe_latency:
+                time.sleep(probe_latency)
+            if 'instagram.com' in url and carousel_size > 1:
+                entries = [self.media_info(f'{media_id}_{index}', photo=index == 1)
+                           for index in range(1, carousel_size + 1)]
+                return self.playlist_result(entries, media_id, media_id)
+            return self.media_info(media_id)
+
+        def media_info(self, media_id, photo=False):
+            if photo:
+                # مثل عضو عکس اینستاگرام: فقط یک فرمت تصویر بدون صدا و تصویر متحرک
+                return {
+                    'id': media_id,
+                    'title': media_id,
+                    'formats': [{
+                        'format_id': 'image',
+                        'url': f'{media_url}/{media_id}.jpg',
+                        'ext': 'jpg',
+                        'width': 1080,
+                        'height': 1080,
+                        'vcodec': 'none',
+                        'acodec': 'none',
+                        'filesize': media_size,
+                    }],
+                }
+            return {
+                'id': media_id,
+                'title': media_id,
+                'duration': 60,
+                'formats': [{
+                    'format_id': '18',
+                    'url': f'{media_url}/{media_id}.mp4',
+                    'ext': 'mp4',
+                    'height': 360,
+                    'vcodec': 'avc1',
+                    'acodec': 'mp4a',
+                    'filesize': media_size,
+                }],
+            }
+
+    original_build = YoutubeDLPool.build
+
+    def build(pool, platform):
+        pooled = original_build(pool, platform)
+        pooled.ydl.params['noprogress'] = True
+        ie = FakeMediaIE()
+        ie.set_downloader(pooled.ydl)
+        pooled.ydl._ies = {ie.ie_key(): ie, **pooled.ydl._ies}
+        pooled.ydl._ies_instances[ie.ie_key()] = ie
+        return pooled
+
+    YoutubeDLPool.build = build
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition(':')
+        mix[kind.strip()] = float(weight or 1)
+    unknown = set(mix) - {'start', 'text', 'link', 'repeat', 'carousel'}
+    if unknown:
+        raise SystemExit(f"unknown update kinds: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def media_id(rand):
+    return ''.join(rand.choice(string.ascii_letters + string.digits) for _ in range(11))
+
+
+def build_updates(args):
+    """جریان ترکیبی آپدیت‌ها به صورت dict، قابل تکرار با seed ثابت"""
+    rand = random.Random(args.seed)
+    kinds, weights = zip(*parse_mix(args.mix).items())
+    hot = [media_id(rand) for _ in range(args.hot_media)]
+    updates = []
+    for update_id in range(1, args.updates + 1):
+        kind = rand.choices(kinds, weights)[0]
+        user_id = 1000 + rand.randrange(args.users)
+        entities = []
+        if kind == 'start':
+            text = '/start'
+            entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        elif kind == 'text':
+            text = 'سلام، این پیام لینک ندارد'
+        elif kind == 'link':
+            text = f'https://youtu.be/{media_id(rand)}'
+        elif kind == 'carousel':
+            text = f'https://www.instagram.com/p/{media_id(rand)}/'
+        else:
+            text = f'https://www.youtube.com/watch?v={rand.choice(hot)}'
+
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }
+        if entities:
+            message['entities'] = entities
+        updates.append((kind, {'update_id': update_id, 'message': message}))
+    return updates
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return 0.0
+
+
+async def run(args):
+    from telegram import Update
+    from bot import TelegramDownloaderBot
+
+    bot = TelegramDownloaderBot()
+    logging.getLogger().setLevel(args.log_level)
+    application = bot.application
+    await application.initialize()
+    await bot.post_init(application)
+
+    updates = [(kind, Update.de_json(data, application.bot)) for kind, data in build_updates(args)]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    async def on_error(update, context):
+        errors[type(context.error).__name__] += 1
+    application.add_error_handler(on_error)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    interval = 1 / args.rate if args.rate else 0
+
+    async def process(kind, update):
+        async with semaphore:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies[kind].append(time.perf_counter() - started)
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    tasks = []
+    for kind, update in updates:
+        tasks.append(asyncio.create_task(process(kind, update)))
+        if interval:
+            await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    await bot.post_shutdown(application)
+    await application.shutdown()
+    return elapsed, latencies, errors, rss_before
+
+
+def report(elapsed, latencies, errors, rss_before, api):
+    total = sum(len(values) for values in latencies.values())
+    print(f"updates            {total}")
+    print(f"elapsed            {elapsed:.2f} s")
+    print(f"throughput         {total / elapsed:.1f} updates/s")
+    print()
+    print(f"{'kind':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = sorted(latencies.items()) + [('all', [value for values in latencies.values() for value in values])]
+    for kind, values in rows:
+        print(f"{kind:<10} {len(values):>6} {percentile(values, 0.5) * 1000:>9.1f} "
+              f"{percentile(values, 0.95) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f} "
+              f"{max(values, default=0) * 1000:>9.1f}")
+    print()
+    print(f"rss                {rss_before:.1f} MB -> {rss_mb():.1f} MB")
+    print(f"peak rss           {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    print(f"bot api calls      {dict(sorted(api.calls.items()))}")
+    print(f"429 injected       {api.rate_limited}")
+    print(f"handler errors     {dict(sorted(errors.items()))}")
+    print(f"uploaded           {api.uploaded_bytes / (1024 * 1024):.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=300, help='تعداد آپدیت‌ها')
+    parser.add_argument('--concurrency', type=int, default=50, help='حداکثر آپدیت هم‌زمان')
+    parser.add_argument('--rate', type=float, default=0, help='نرخ ورود آپدیت در ثانیه (0 یعنی بدون محدودیت)')
+    parser.add_argument('--users', type=int, default=200, help='تعداد کاربران متمایز')
+    parser.add_argument('--mix', default='start:1,text:1,link:6,repeat:2', help='وزن انواع آپدیت')
+    parser.add_argument('--hot-media', type=int, default=10, help='تعداد مدیاهای پرتکرار برای repeat')
+    parser.add_argument('--media-size', type=int, default=1024 * 1024, help='حجم فایل مصنوعی (بایت)')
+    parser.add_argument('--probe-latency', type=float, default=0.05, help='تاخیر extractor ساختگی (ثانیه)')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='تاخیر هر درخواست Bot API (ثانیه)')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='نسبت پاسخ‌های 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='مقدار retry_after در پاسخ 429')
+    parser.add_argument('--carousel-size', type=int, default=4, help='تعداد اعضای پست‌های اینستاگرام')
+    parser.add_argument('--local-mode', action='store_true', help='ارسال مسیر فایل مانند سرور Bot API محلی')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.api_latency, args.rate_limit_ratio, args.retry_after, args.seed)
+    api_url = api.start()
+    media_server = serve_media(args.media_size)
+    install_fake_extractor(f'http://127.0.0.1:{media_server.server_port}', args.media_size, args.probe_latency,
+                           args.carousel_size)
+
+    os.environ['TELEGRAM_BOT_TOKEN'] = BOT_TOKEN
+    os.environ['TELEGRAM_API_URL'] = api_url
+    if args.local_mode:
+        os.environ['TELEGRAM_LOCAL_MODE'] = 'true'
+    os.environ.setdefault('METRICS_PORT', '0')
+
+    # فایل‌های دانلود شده در پوشه موقت ساخته می‌شوند، نه در ریشه پروژه
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        elapsed, latencies, errors, rss_before = asyncio.run(run(args))
+        os.chdir(ROOT)
+
+    report(elapsed, latencies, errors, rss_before, api)
+    media_server.shutdown()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
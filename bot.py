@@ -1,11 +1,29 @@
 import os
+import time
+import asyncio
 import logging
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.ext import (Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler,
+                          TypeHandler)
 
-from database import Database
+from database import Database, AsyncDatabase
 from downloader import Downloader
 from admin_panel import AdminPanel
+from download_queue import DownloadQueue
+from file_cache import FileCache
+from write_buffer import WriteBehindBuffer
+from broadcast import BroadcastEngine
+from inflight import InflightRegistry
+from url_parser import extract_links
+from uploader import Uploader, local_mode_enabled
+from progress import ProgressReporter
+from membership import MembershipGate
+from metrics import (MetricsServer, RequestTrace, StartupProfile, REQUESTS, UPLOAD_SECONDS, UPLOADED_BYTES,
+                     QUEUE_DEPTH, IN_FLIGHT)
+
+# زمان‌بندی cold start از شروع پروسه؛ yt_dlp و اتصال دیتابیس عمدا بعد از آماده شدن ربات بارگذاری می‌شوند
+STARTUP = StartupProfile()
+STARTUP.mark('imports')
 
 # تنظیمات logging
 logging.basicConfig(
@@ -15,38 +33,127 @@ logging.basicConfig(
 
 class TelegramDownloaderBot:
     def __init__(self):
+        self.max_links_per_message = int(os.environ.get('MAX_LINKS_PER_MESSAGE', 5))
+        # standalone: دانلود در همین پروسه؛ frontend: فقط ثبت کار در صف دیتابیس برای job_worker.py
+        self.mode = os.environ.get('BOT_MODE', 'standalone')
         self.token = os.environ.get('TELEGRAM_BOT_TOKEN')
         if not self.token:
             raise ValueError("❌ لطفا TELEGRAM_BOT_TOKEN را تنظیم کنید")
         
         try:
-            self.db = Database()
-            # بررسی اینکه اتصال دیتابیس موفق بوده
-            if not self.db.connection:
-                logging.warning("⚠️ Database connection failed, running in limited mode")
+            # متدهای دیتابیس به صورت awaitable و روی pool اتصال اجرا می‌شوند؛
+            # اتصال و migrationها در warmup و بدون معطل کردن پاسخ به آپدیت‌ها انجام می‌شوند
+            self.db = AsyncDatabase(Database(connect=False))
         except Exception as e:
             logging.error(f"❌ Database initialization failed: {e}")
             self.db = None
         
         self.downloader = Downloader()
+        self.download_queue = DownloadQueue(self.downloader)
+        # درخواست‌های هم‌زمان برای یک مدیا در یک دانلود شریک می‌شوند
+        self.inflight = InflightRegistry(self.downloader.cleanup_dir)
+        self.file_cache = FileCache(self.db)
+        # ثبت کاربران و شمارنده دانلودها به صورت دسته‌ای و تاخیری
+        self.write_buffer = WriteBehindBuffer(self.db) if self.db else None
+        self.broadcaster = BroadcastEngine(self.db) if self.db else None
+        self.membership = MembershipGate(self.db) if self.db else None
+        # پایان تلاش اول اتصال دیتابیس در warmup؛ بررسی عضویت اجباری پس از بیدار شدن منتظرش می‌ماند
+        self.db_ready = asyncio.Event()
+        self.db_ready_timeout = float(os.environ.get('DB_READY_TIMEOUT', 5))
+
+        # متریک‌ها روی پورت جانبی METRICS_PORT (جدا از پورت وب‌هوک) ارائه می‌شوند
+        self.metrics_server = MetricsServer()
+        self.uploads_active = 0
+        self.uploader = Uploader()
+        # ویرایش پیام وضعیت با درصد، سرعت و زمان باقی‌مانده، با محدودیت نرخ برای هر چت
+        self.progress = ProgressReporter()
+        QUEUE_DEPTH.set_function(lambda: self.download_queue.queued)
+        IN_FLIGHT.set_function(lambda: self.download_queue.active, kind='downloads')
+        IN_FLIGHT.set_function(lambda: self.uploads_active, kind='uploads')
+        IN_FLIGHT.set_function(lambda: len(self.inflight.flights), kind='media')
         
         try:
-            self.admin_panel = AdminPanel(self.db)
+            self.admin_panel = AdminPanel(self.db, self.file_cache, self.broadcaster, self.membership)
         except Exception as e:
             logging.error(f"❌ Admin panel initialization failed: {e}")
             self.admin_panel = None
         
-        self.application = Application.builder().token(self.token).build()
+        # concurrent_updates تا انتظار برای یک دانلود، پاسخ به بقیه کاربران را متوقف نکند
+        builder = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(True)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        # سرور Bot API جایگزین، مثلا سرور ساختگی benchmarks/load_test.py یا telegram-bot-api --local
+        api_url = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
+        if api_url:
+            builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+            builder = builder.local_mode(local_mode_enabled())
+        self.application = builder.build()
         self.setup_handlers()
+        self.warmup_task = None
+        STARTUP.mark('init')
+
+    async def post_init(self, application):
+        await self.metrics_server.start()
+        # دانلودهای رسیده پیش از آماده شدن yt_dlp در صف می‌مانند
+        downloader_ready = asyncio.get_running_loop().run_in_executor(None, self.downloader.warmup)
+        await self.download_queue.start(downloader_ready)
+        if self.write_buffer:
+            await self.write_buffer.start()
+        self.warmup_task = asyncio.create_task(self.warmup(application, downloader_ready))
+        STARTUP.mark('post_init')
+
+    async def warmup(self, application, downloader_ready):
+        """کارهای کند راه‌اندازی در پس‌زمینه: اتصال دیتابیس، migrationها و بارگذاری yt_dlp"""
+        try:
+            if self.db:
+                try:
+                    connected = await self.db.start()
+                finally:
+                    self.db_ready.set()
+                if connected:
+                    STARTUP.mark('database')
+                    if self.broadcaster:
+                        await self.broadcaster.resume(application.bot)
+                else:
+                    logging.warning("⚠️ Database connection failed, running in limited mode")
+            await asyncio.wait([downloader_ready])
+            STARTUP.mark('downloader')
+        except Exception as e:
+            logging.error(f"❌ Startup warmup error: {e}")
+        STARTUP.report('post_init')
+
+    async def mark_first_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        STARTUP.mark('first_update')
+
+    async def post_shutdown(self, application):
+        if self.warmup_task:
+            self.warmup_task.cancel()
+        await self.download_queue.stop()
+        self.downloader.close()
+        if self.broadcaster:
+            await self.broadcaster.stop()
+        if self.write_buffer:
+            await self.write_buffer.stop()
+        if self.db:
+            self.db.close()
+        await self.metrics_server.stop()
 
     def setup_handlers(self):
+        # زمان رسیدن اولین آپدیت پس از شروع پروسه؛ گروه -1 روی هندلرهای اصلی اثری ندارد
+        self.application.add_handler(TypeHandler(Update, self.mark_first_update), group=-1)
+
         # دستورات پایه که بدون دیتابیس هم کار می‌کنند
         self.application.add_handler(CommandHandler("start", self.start))
         
-        # فقط اگر دیتابیس فعال است، هندلرهای ادمین را اضافه کن
-        if self.db and self.db.connection:
+        # اتصال دیتابیس در پس‌زمینه برقرار می‌شود؛ هندلرهای ادمین خودشان وضعیت اتصال را بررسی می‌کنند
+        if self.db:
             self.application.add_handler(CommandHandler("admin", self.admin_command))
             self.application.add_handler(CallbackQueryHandler(self.handle_admin_callback, pattern="^admin_"))
+            self.application.add_handler(CallbackQueryHandler(self.handle_membership_check, pattern="^check_membership$"))
         else:
             logging.warning("⚠️ Admin features disabled due to database connection issues")
         
@@ -56,9 +163,9 @@ class TelegramDownloaderBot:
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         
-        # اگر دیتابیس در دسترس است، کاربر را ثبت کن
-        if self.db and self.db.connection:
-            self.db.add_user(user.id, user.username, user.first_name, user.last_name)
+        # ثبت در بافر حتی پیش از وصل شدن دیتابیس؛ flush خودش وصل می‌شود و در صورت خطا داده را نگه می‌دارد
+        if self.write_buffer:
+            self.write_buffer.add_user(user.id, user.username, user.first_name, user.last_name)
         
         welcome_text = """
 🤖 **به ربات دانلود از یوتیوب و اینستاگرام خوش آمدید!**
@@ -75,14 +182,14 @@ class TelegramDownloaderBot:
         """
         
         # اگر دیتابیس فعال است، اطلاعات ادمین را اضافه کن
-        if self.db and self.db.connection:
+        if self.admin_panel:
             welcome_text += "\n/admin - پنل مدیریت (فقط ادمین)"
         
         await update.message.reply_text(welcome_text, parse_mode='Markdown')
 
     async def admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور ادمین فقط اگر دیتابیس فعال است"""
-        if not self.admin_panel:
+        if not self.admin_panel or not self.db.is_connected():
             await update.message.reply_text("❌ پنل مدیریت در حال حاضر در دسترس نیست")
             return
         
@@ -90,7 +197,7 @@ class TelegramDownloaderBot:
 
     async def handle_admin_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """مدیریت callback های ادمین"""
-        if not self.admin_panel:
+        if not self.admin_panel or not self.db.is_connected():
             await update.callback_query.answer("❌ پنل مدیریت در حال حاضر در دسترس نیست")
             return
         
@@ -100,57 +207,310 @@ class TelegramDownloaderBot:
         user = update.effective_user
         message_text = update.message.text
         
-        # بررسی وضعیت‌های پنل ادمین
-        if (self.admin_panel and 
-            context.user_data.get('waiting_for_channel')):
-            await self.admin_panel.process_channel_input(update, context)
-            return
-            
-        if (self.admin_panel and 
-            context.user_data.get('waiting_for_broadcast')):
-            await self.admin_panel.process_broadcast_message(update, context)
-            return
+        # بررسی وضعیت‌های پنل ادمین؛ وضعیت در دیتابیس است و فقط برای ادمین‌ها خوانده می‌شود
+        if self.admin_panel and self.admin_panel.is_admin(user.id):
+            state = await self.admin_panel.get_state(user.id)
+            if state == 'waiting_for_channel':
+                await self.admin_panel.process_channel_input(update, context)
+                return
+
+            if state == 'waiting_for_broadcast':
+                await self.admin_panel.process_broadcast_message(update, context)
+                return
         
-        # بررسی لینک
-        if self.is_valid_url(message_text):
-            await self.process_download(update, context, message_text, user.id)
+        # استخراج همه لینک‌های معتبر پیام و پردازش موازی آن‌ها
+        links = extract_links(message_text, limit=self.max_links_per_message)
+        if links:
+            # عضویت اجباری در کانال‌ها
+            missing = await self.missing_channels(context, user.id)
+            if missing:
+                await update.message.reply_text(
+                    "🔒 برای استفاده از ربات ابتدا در کانال‌های زیر عضو شوید:",
+                    reply_markup=self.membership.join_keyboard(missing)
+                )
+                return
+
+            await asyncio.gather(*(self.process_download(update, context, link, user.id) for link in links))
         else:
             await update.message.reply_text("❌ لینک معتبر نیست. لطفا لینک یوتیوب یا اینستاگرام ارسال کنید.")
 
-    def is_valid_url(self, text):
-        return any(domain in text for domain in ['youtube.com', 'youtu.be', 'instagram.com'])
+    async def missing_channels(self, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+        if not self.membership:
+            return []
+        if self.admin_panel and self.admin_panel.is_admin(user_id):
+            return []
+        if not self.db.is_connected():
+            if self.db_ready.is_set():
+                # حالت محدود: لیست کانال‌ها در دسترس نیست؛ اتصال مجدد با flush بافر نوشتن انجام می‌شود
+                return []
+            # پس از بیدار شدن از حالت بیکار، تا اتصال پس‌زمینه صبر می‌کنیم تا عضویت اجباری باز نماند
+            try:
+                await asyncio.wait_for(self.db_ready.wait(), self.db_ready_timeout)
+            except asyncio.TimeoutError:
+                logging.warning("⚠️ Database not ready for membership check")
+        return await self.membership.missing_channels(context.bot, user_id)
 
-    async def process_download(self, update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, user_id: int):
-        processing_msg = await update.message.reply_text("⏳ در حال پردازش لینک...")
-        
-        # دانلود مدیا
-        file_path, error = self.downloader.download_media(url)
-        
-        if error:
-            await processing_msg.edit_text(f"❌ {error}")
+    async def handle_membership_check(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دکمه «عضو شدم»: کش عضویت کاربر باطل و دوباره بررسی می‌شود"""
+        query = update.callback_query
+        self.membership.invalidate(query.from_user.id)
+        missing = await self.missing_channels(context, query.from_user.id)
+
+        if missing:
+            await query.answer("❌ هنوز در همه کانال‌ها عضو نشده‌اید", show_alert=True)
             return
-        
-        # ارسال فایل
+
+        await query.answer()
+        await query.edit_message_text("✅ عضویت شما تایید شد. حالا لینک را دوباره ارسال کنید.")
+
+    def record_download(self, user_id: int, platform, started, status, size=0, cache_hit=False):
+        """ثبت رویداد دانلود برای آمار؛ دانلودهای موفق شمارنده کاربر را هم افزایش می‌دهند"""
+        REQUESTS.inc(platform=platform, status=status, cache_hit=str(cache_hit).lower())
+        if self.write_buffer:
+            duration_ms = int((time.monotonic() - started) * 1000)
+            self.write_buffer.record_download(user_id, platform, size, duration_ms, cache_hit, status)
+
+    async def send_file_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_id):
+        await self.uploader.send_file_id(
+            context.bot,
+            update.effective_chat.id,
+            file_id,
+            caption="✅ دانلود با موفقیت انجام شد"
+        )
+
+    async def send_cached(self, update: Update, context: ContextTypes.DEFAULT_TYPE, media_key):
+        """ارسال مستقیم با file_id کش شده؛ اگر کش نبود یا file_id نامعتبر شد False برمی‌گرداند"""
+        # پست‌های چندتایی فقط وقتی از کش ارسال می‌شوند که file_id همه اعضا موجود باشد
+        file_id = await self.file_cache.get_media(media_key)
+        if not file_id:
+            return False
+
+        try:
+            await self.send_file_id(update, context, file_id)
+        except Exception as e:
+            logging.warning(f"Cached file_id rejected for {media_key}: {e}")
+            await self.file_cache.invalidate(media_key)
+            return False
+        return True
+
+    async def upload_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_path, processing_msg,
+                          media_key, progress):
+        """آپلود فایل دانلود شده یا اعضای پست چندتایی در media group؛ خروجی (success, file_id)"""
+        started = time.perf_counter()
+        self.uploads_active += 1
         try:
-            with open(file_path, 'rb') as file:
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id,
-                    document=file,
-                    caption="✅ دانلود با موفقیت انجام شد"
+            try:
+                file_id = await self.uploader.send_media(
+                    context.bot,
+                    update.effective_chat.id,
+                    file_path,
+                    caption="✅ دانلود با موفقیت انجام شد",
+                    thumbnail_for=self.downloader.thumbnail_for,
+                    progress=progress.upload
                 )
-            
-            # آپدیت آمار اگر دیتابیس فعال است
-            if self.db and self.db.connection:
-                self.db.increment_download_count(user_id)
-            
-            # پاکسازی فایل
-            self.downloader.cleanup_file(file_path)
-            
-            await processing_msg.delete()
-            
+            except Exception:
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome='failed')
+                raise
+            finally:
+                self.uploads_active -= 1
+
+            UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome='success')
+            UPLOADED_BYTES.inc(self.downloader.media_size(file_path))
+
         except Exception as e:
+            progress.close()
             await processing_msg.edit_text(f"❌ خطا در ارسال فایل: {str(e)}")
-            self.downloader.cleanup_file(file_path)
+            return False, None
+
+        # فایل رسیده است؛ خطای کش یا حذف پیام وضعیت (مثلا 429) نباید آپلود را ناموفق نشان دهد
+        progress.close()
+        try:
+            if media_key and file_id:
+                await self.file_cache.put_media(media_key, file_path, file_id)
+        except Exception as e:
+            logging.error(f"File cache write error: {e}")
+        try:
+            await processing_msg.delete()
+        except Exception as e:
+            logging.warning(f"Status message delete error: {e}")
+        return True, file_id
+
+    async def process_download(self, update: Update, context: ContextTypes.DEFAULT_TYPE, link, user_id: int):
+        if link.kind == 'playlist':
+            await update.message.reply_text("❌ دانلود پلی‌لیست پشتیبانی نمی‌شود؛ لینک یک ویدیو را ارسال کنید")
+            return
+
+        # لینک‌ها به شکل استاندارد تبدیل می‌شوند تا کش و ادغام برای همه شکل‌های یک لینک کار کند
+        url = link.url
+
+        started = time.monotonic()
+        trace = RequestTrace(f"user={user_id} {link.platform}:{link.media_id}")
+
+        # لینک‌های تکراری بدون دانلود و آپلود مجدد از کش file_id ارسال می‌شوند
+        media_key = self.downloader.get_media_key(link)
+        if media_key and await self.send_cached(update, context, media_key):
+            self.record_download(user_id, link.platform, started, 'success', cache_hit=True)
+            trace.mark('cached_send')
+            trace.finish('success')
+            return
+        trace.mark('cache_lookup')
+
+        # اگر دیتابیس در دسترس نباشد، حالت frontend هم در همین پروسه دانلود می‌کند
+        if self.mode == 'frontend' and self.db and self.db.is_connected():
+            status = await self.enqueue_download(update, url, user_id)
+            trace.mark('enqueue')
+            if status != 'queued':
+                self.record_download(user_id, link.platform, started, status)
+            trace.finish(status)
+            return
+
+        # لینک‌هایی که کلید مدیا ندارند با هیچ درخواست دیگری ادغام نمی‌شوند
+        flight, leader = self.inflight.acquire(media_key or object())
+        try:
+            if leader:
+                status, size, cache_hit = await self.lead_download(update, context, flight, url, media_key, user_id,
+                                                                   trace)
+            else:
+                status, size, cache_hit = await self.follow_download(update, context, flight, media_key, trace)
+        finally:
+            self.inflight.release(flight)
+
+        self.record_download(user_id, link.platform, started, status, size, cache_hit)
+        trace.finish(status)
+
+    async def enqueue_download(self, update: Update, url: str, user_id: int):
+        """ثبت دانلود در صف مشترک دیتابیس؛ ورکرهای job_worker.py آن را برمی‌دارند، دانلود و ارسال می‌کنند"""
+        is_admin = bool(self.admin_panel and self.admin_panel.is_admin(user_id))
+        ahead, user_jobs = await self.db.get_download_queue_state(user_id, is_admin)
+        error = self.download_queue.admission_error(user_id, is_admin, user_jobs, ahead)
+        if error:
+            await update.message.reply_text(f"❌ {error}")
+            return 'rejected'
+
+        processing_msg = await update.message.reply_text(f"🕒 در صف دانلود... جایگاه شما: {ahead + 1}")
+        job_id = await self.db.enqueue_download_job(
+            user_id, update.effective_chat.id, processing_msg.message_id, url, is_admin
+        )
+        if not job_id:
+            await processing_msg.edit_text("❌ خطا در ثبت درخواست دانلود")
+            return 'failed'
+        return 'queued'
+
+    async def lead_download(self, update: Update, context: ContextTypes.DEFAULT_TYPE, flight, url: str,
+                            media_key, user_id: int, trace):
+        """اولین درخواست یک مدیا: دانلود در صف و آپلود، و اشتراک نتیجه با درخواست‌های هم‌زمان
+
+        خروجی (status, bytes, cache_hit) برای ثبت آمار است.
+        """
+        # ادمین‌ها از مسیر اولویت‌دار و بدون محدودیت نرخ عبور می‌کنند
+        is_admin = bool(self.admin_panel and self.admin_panel.is_admin(user_id))
+        job, error = self.download_queue.submit(user_id, url, priority=is_admin)
+        if error:
+            flight.finish(error=error)
+            self.inflight.discard(flight)
+            await update.message.reply_text(f"❌ {error}")
+            return 'rejected', 0, False
+        # پیش از هر await تنظیم می‌شود چون ورکر ممکن است بلافاصله دانلود را شروع کند
+        job.progress = flight.report
+
+        try:
+            position = self.download_queue.position(job)
+            if position > 0:
+                processing_msg = await update.message.reply_text(f"🕒 در صف دانلود... جایگاه شما: {position}")
+
+                async def on_start():
+                    await processing_msg.edit_text("⏳ در حال پردازش لینک...")
+                job.on_start = on_start
+            else:
+                processing_msg = await update.message.reply_text("⏳ در حال پردازش لینک...")
+        except Exception:
+            self.abandon_job(job, flight)
+            raise
+        progress = self.track_progress(update, flight, processing_msg)
+
+        try:
+            # دانلود مدیا در ورکرهای صف، بدون مسدود کردن event loop
+            try:
+                # shield تا لغو این درخواست future کار را لغو نکند و پاکسازی به پایان واقعی دانلود گره بخورد
+                file_path, error = await asyncio.shield(job.future)
+            except asyncio.CancelledError:
+                # کار شروع نشده از صف حذف می‌شود؛ وگرنه بعدا اجرا و پوشه و رزرو staging آن رها می‌شد
+                self.download_queue.cancel(job)
+                self.abandon_job(job, flight)
+                raise
+
+            # آزاد کردن سهمیه کاربر؛ پاکسازی فایل با آخرین درخواست شریک انجام می‌شود
+            self.download_queue.release(job)
+            flight.output_dir = job.output_dir
+            if job.started_at and job.finished_at:
+                trace.mark('queue', at=job.started_at)
+                trace.mark('download', at=job.finished_at)
+
+            flight.result.set_result((file_path, error))
+            if error:
+                progress.close()
+                await processing_msg.edit_text(f"❌ {error}")
+                return 'failed', 0, False
+
+            size = self.downloader.media_size(file_path)
+            success, file_id = await self.upload_file(update, context, file_path, processing_msg, media_key,
+                                                      progress)
+            trace.mark('upload')
+            flight.file_id.set_result(file_id)
+            return ('success' if success else 'failed'), size, False
+        finally:
+            self.stop_progress(flight, progress)
+            flight.finish(error="خطا در دانلود")
+
+    def track_progress(self, update: Update, flight, processing_msg):
+        progress = self.progress.track(update.effective_chat.id, processing_msg.edit_text, processing_msg.text)
+        flight.progress.append(progress)
+        return progress
+
+    def stop_progress(self, flight, progress):
+        progress.close()
+        if progress in flight.progress:
+            flight.progress.remove(progress)
+
+    def abandon_job(self, job, flight):
+        """کاری که درخواستش شکست خورده یا لغو شده: درخواست‌های شریک خطا می‌گیرند و سهمیه و فایل پس از پایان آزاد می‌شوند"""
+        flight.finish(error="خطا در ارسال پیام")
+        self.inflight.discard(flight)
+
+        def release(_):
+            self.download_queue.release(job)
+            if job.output_dir:
+                self.downloader.cleanup_dir(job.output_dir)
+        job.future.add_done_callback(release)
+
+    async def follow_download(self, update: Update, context: ContextTypes.DEFAULT_TYPE, flight, media_key, trace):
+        """درخواست هم‌زمان برای مدیایی که در حال دانلود است: منتظر همان نتیجه می‌ماند"""
+        processing_msg = await update.message.reply_text("⏳ در حال پردازش لینک...")
+        progress = self.track_progress(update, flight, processing_msg)
+        try:
+            file_path, error = await asyncio.shield(flight.result)
+            trace.mark('shared_download')
+            self.stop_progress(flight, progress)
+            if error:
+                await processing_msg.edit_text(f"❌ {error}")
+                return 'failed', 0, False
+
+            file_id = await asyncio.shield(flight.file_id)
+            if file_id:
+                try:
+                    await self.send_file_id(update, context, file_id)
+                    await processing_msg.delete()
+                    trace.mark('shared_send')
+                    return 'success', 0, True
+                except Exception as e:
+                    logging.warning(f"Shared file_id rejected for {media_key}: {e}")
+
+            # آپلود اول ناموفق بود؛ فایل تا پایان کار این درخواست روی دیسک باقی می‌ماند
+            progress = self.progress.track(update.effective_chat.id, processing_msg.edit_text, processing_msg.text)
+            success, _ = await self.upload_file(update, context, file_path, processing_msg, media_key, progress)
+            return ('success' if success else 'failed'), (self.downloader.media_size(file_path) if success else 0), False
+        finally:
+            self.stop_progress(flight, progress)
 
     def run(self):
         # برای Render - استفاده از Webhook
@@ -0,0 +1,203 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+from contextlib import aclosing
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from rate_limiter import TokenBucket
+
+
+class BroadcastJob:
+    def __init__(self, job_id, admin_chat_id, from_chat_id, message_id, progress_message_id=None,
+                 last_user_id=0, total=0, sent=0, failed=0, blocked=0):
+        self.job_id = job_id
+        self.admin_chat_id = admin_chat_id
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.progress_message_id = progress_message_id
+        self.last_user_id = last_user_id
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+
+    def progress_text(self, finished=False):
+        done = self.sent + self.failed + self.blocked
+        percent = (done / self.total * 100) if self.total else 100.0
+        title = "📊 نتیجه ارسال همگانی" if finished else "🚀 در حال ارسال پیام همگانی"
+        return (
+            f"{title}:\n\n"
+            f"📨 پیشرفت: {done}/{self.total} ({percent:.0f}%)\n"
+            f"✅ موفق: {self.sent}\n"
+            f"❌ ناموفق: {self.failed}\n"
+            f"🚫 بلاک شده: {self.blocked}"
+        )
+
+
+class BroadcastEngine:
+    """ارسال همگانی هم‌زمان با محدودیت نرخ تلگرام، ذخیره پیشرفت در دیتابیس و ادامه پس از ری‌استارت
+
+    با چند نمونه frontend (یا deploy هم‌پوشان) هر کار مثل download_jobs مالک دارد: با heartbeat تمدید می‌شود
+    و فقط وقتی heartbeat صاحبش بیش از BROADCAST_VISIBILITY_TIMEOUT قطع شود، نمونه دیگری ادامه‌اش می‌دهد.
+    """
+
+    def __init__(self, database):
+        self.db = database
+        self.batch_size = int(os.environ.get('BROADCAST_BATCH_SIZE', 500))
+        self.concurrency = int(os.environ.get('BROADCAST_CONCURRENCY', 20))
+        self.max_retries = int(os.environ.get('BROADCAST_MAX_RETRIES', 3))
+        self.progress_interval = float(os.environ.get('BROADCAST_PROGRESS_INTERVAL', 5))
+        # محدودیت سراسری تلگرام حدود ۳۰ پیام در ثانیه است؛ کمی پایین‌تر می‌مانیم
+        self.bucket = TokenBucket(float(os.environ.get('BROADCAST_RATE', 25)))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_interval = float(os.environ.get('BROADCAST_HEARTBEAT_INTERVAL', 10))
+        self.visibility_timeout = float(os.environ.get('BROADCAST_VISIBILITY_TIMEOUT', 60))
+        self.tasks = {}
+        self.reclaimer = None
+
+    async def start(self, bot, admin_chat_id, from_chat_id, message_id):
+        total = await self.db.count_active_users()
+        job_id = await self.db.create_broadcast_job(admin_chat_id, from_chat_id, message_id, total, self.worker_id)
+        if job_id is None:
+            return None
+
+        job = BroadcastJob(job_id, admin_chat_id, from_chat_id, message_id, total=total)
+        progress = await bot.send_message(chat_id=admin_chat_id, text=job.progress_text())
+        job.progress_message_id = progress.message_id
+        await self.save_progress(job)
+
+        self.launch(bot, job)
+        return job
+
+    async def resume(self, bot):
+        """ادامه کارهای نیمه‌تمامی که صاحبشان از کار افتاده؛ به صورت دوره‌ای در پس‌زمینه بررسی می‌شود"""
+        if self.reclaimer is None:
+            self.reclaimer = asyncio.create_task(self.reclaim(bot))
+
+    async def reclaim(self, bot):
+        while True:
+            try:
+                while True:
+                    row = await self.db.claim_broadcast_job(self.worker_id, self.visibility_timeout)
+                    if not row:
+                        break
+                    job = BroadcastJob(*row)
+                    logging.info(f"🔁 Resuming broadcast job {job.job_id} after user {job.last_user_id}")
+                    self.launch(bot, job)
+            except Exception as e:
+                logging.error(f"❌ Broadcast reclaim error: {e}")
+            await asyncio.sleep(self.visibility_timeout / 2)
+
+    def launch(self, bot, job):
+        task = asyncio.create_task(self.run(bot, job))
+        self.tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job.job_id, None))
+
+    async def stop(self):
+        # پیشرفت هر دسته پس از اتمامش ذخیره شده؛ کار از همان نقطه ادامه پیدا می‌کند
+        if self.reclaimer:
+            self.reclaimer.cancel()
+        job_ids = list(self.tasks)
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # رها کردن مالکیت تا نمونه دیگر بدون انتظار برای انقضای heartbeat ادامه دهد
+        for job_id in job_ids:
+            await self.db.release_broadcast_job(job_id, self.worker_id)
+
+    async def heartbeat(self, job, task):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            owned = await self.db.heartbeat_broadcast_job(job.job_id, self.worker_id)
+            if owned is False:
+                # کار به نمونه دیگری رسیده؛ ادامه ارسال در اینجا پیام تکراری می‌فرستد
+                logging.warning(f"⚠️ Lost ownership of broadcast job {job.job_id}, stopping")
+                task.cancel()
+                return
+            if owned is None:
+                logging.warning(f"⚠️ Heartbeat failed for broadcast job {job.job_id}, retrying")
+
+    async def run(self, bot, job):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_report = time.monotonic()
+        heartbeat = asyncio.create_task(self.heartbeat(job, asyncio.current_task()))
+
+        async def deliver(user_id):
+            async with semaphore:
+                return user_id, await self.send_one(bot, job, user_id)
+
+        try:
+            batches = await self.db.iter_user_batches(job.last_user_id, self.batch_size)
+            # بسته شدن cursor و برگشت اتصال به pool همین‌جا، حتی با لغو، نه هنگام garbage collection
+            async with aclosing(self.db.iterate(batches)) as users:
+                async for user_ids in users:
+                    results = await asyncio.gather(*(deliver(uid) for uid in user_ids))
+
+                    blocked_ids = [uid for uid, status in results if status == 'blocked']
+                    job.sent += sum(1 for _, status in results if status == 'sent')
+                    job.failed += sum(1 for _, status in results if status == 'failed')
+                    job.blocked += len(blocked_ids)
+                    job.last_user_id = user_ids[-1]
+
+                    if blocked_ids:
+                        await self.db.mark_users_blocked(blocked_ids)
+                    if await self.save_progress(job) is False:
+                        logging.warning(f"⚠️ Lost ownership of broadcast job {job.job_id}, stopping")
+                        return
+
+                    if time.monotonic() - last_report >= self.progress_interval:
+                        await self.report(bot, job)
+                        last_report = time.monotonic()
+
+            await self.save_progress(job, status='done')
+            await self.report(bot, job, finished=True)
+            logging.info(f"✅ Broadcast job {job.job_id} finished: {job.sent} sent, {job.failed} failed")
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"❌ Broadcast job {job.job_id} error: {e}")
+        finally:
+            heartbeat.cancel()
+
+    async def send_one(self, bot, job, user_id):
+        for _ in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                # copy_message همه انواع پیام (متن، عکس، ویدیو، ...) را بدون دانلود مجدد کپی می‌کند
+                await bot.copy_message(chat_id=user_id, from_chat_id=job.from_chat_id, message_id=job.message_id)
+                return 'sent'
+            except RetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    return 'blocked'
+                logging.error(f"Broadcast error for user {user_id}: {e}")
+                return 'failed'
+            except Exception as e:
+                logging.error(f"Broadcast error for user {user_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+    async def save_progress(self, job, status='running'):
+        """خروجی False یعنی کار دیگر متعلق به این نمونه نیست"""
+        return await self.db.update_broadcast_job(job.job_id, self.worker_id, job.last_user_id, job.sent,
+                                                  job.failed, job.blocked, job.progress_message_id, status)
+
+    async def report(self, bot, job, finished=False):
+        try:
+            if job.progress_message_id:
+                await bot.edit_message_text(chat_id=job.admin_chat_id, message_id=job.progress_message_id,
+                                            text=job.progress_text(finished))
+            else:
+                await bot.send_message(chat_id=job.admin_chat_id, text=job.progress_text(finished))
+        except BadRequest as e:
+            # "message is not modified" و موارد مشابه
+            logging.debug(f"Broadcast progress edit skipped: {e}")
+        except Exception as e:
+            logging.error(f"Broadcast progress report error: {e}")
@@ -1,126 +1,485 @@
 import os
+import asyncio
+import functools
+import threading
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
 import logging
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import urlparse
 
+from metrics import DB_SECONDS, DB_ERRORS
+
+
+# تغییرات schema به ترتیب نسخه؛ هر نسخه فقط یک بار اجرا و در جدول schema_migrations ثبت می‌شود.
+# دستورها idempotent هستند چون دیتابیس‌های قدیمی‌تر این جدول‌ها را بدون ثبت نسخه دارند.
+# برای تغییر schema نسخه جدیدی به انتهای لیست اضافه کنید و نسخه‌های قبلی را ویرایش نکنید.
+MIGRATIONS = [
+    (1, 'users and forced channels', [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            download_count INTEGER DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS forced_channels (
+            channel_id BIGINT PRIMARY KEY,
+            channel_username VARCHAR(255),
+            channel_title VARCHAR(255),
+            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, 'blocked users and broadcast jobs', [
+        # کاربرانی که ربات را بلاک کرده‌اند در ارسال همگانی بعدی رد می‌شوند
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE",
+        # کارهای ارسال همگانی برای ادامه پس از ری‌استارت
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id SERIAL PRIMARY KEY,
+            admin_chat_id BIGINT NOT NULL,
+            from_chat_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            progress_message_id BIGINT,
+            status VARCHAR(16) DEFAULT 'running',
+            last_user_id BIGINT DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (3, 'file_id cache', [
+        """
+        CREATE TABLE IF NOT EXISTS file_cache (
+            platform VARCHAR(32),
+            media_id VARCHAR(255),
+            format VARCHAR(64),
+            file_id VARCHAR(255) NOT NULL,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (platform, media_id, format)
+        )
+        """,
+    ]),
+    (4, 'download events and rollups', [
+        """
+        CREATE TABLE IF NOT EXISTS download_events (
+            event_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            platform VARCHAR(32),
+            bytes BIGINT DEFAULT 0,
+            duration_ms INTEGER DEFAULT 0,
+            cache_hit BOOLEAN DEFAULT FALSE,
+            status VARCHAR(16),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS download_events_created_idx ON download_events (created_at)",
+        "CREATE INDEX IF NOT EXISTS download_events_user_idx ON download_events (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS download_events_platform_idx ON download_events (platform, created_at)",
+    ] + [
+        # تجمیع ساعتی و روزانه دانلودها که همراه با ثبت رویدادها به‌روز می‌شوند
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket TIMESTAMP,
+            platform VARCHAR(32),
+            status VARCHAR(16),
+            downloads BIGINT DEFAULT 0,
+            bytes BIGINT DEFAULT 0,
+            cache_hits BIGINT DEFAULT 0,
+            duration_ms BIGINT DEFAULT 0,
+            PRIMARY KEY (bucket, platform, status)
+        )
+        """ for table in ('download_stats_hourly', 'download_stats_daily')
+    ]),
+    (5, 'shared download queue', [
+        # صف مشترک کارهای دانلود برای حالت چند پروسه‌ای (BOT_MODE=frontend و job_worker.py)
+        """
+        CREATE TABLE IF NOT EXISTS download_jobs (
+            job_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            status_message_id BIGINT,
+            url TEXT NOT NULL,
+            priority BOOLEAN DEFAULT FALSE,
+            status VARCHAR(16) DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            worker_id VARCHAR(128),
+            heartbeat_at TIMESTAMP,
+            error TEXT,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_date TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS download_jobs_queued_idx
+        ON download_jobs (priority DESC, job_id) WHERE status = 'queued'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS download_jobs_running_idx
+        ON download_jobs (heartbeat_at) WHERE status = 'running'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS download_jobs_user_idx
+        ON download_jobs (user_id) WHERE status IN ('queued', 'running')
+        """,
+    ]),
+    (6, 'conversation state', [
+        # وضعیت گفتگوی ادمین‌ها تا آپدیت بعدی روی هر نمونه‌ای از ربات برسد
+        """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            user_id BIGINT PRIMARY KEY,
+            state VARCHAR(32) NOT NULL,
+            updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (7, 'stats counters', [
+        # شمارنده‌های کلی که به جای COUNT/SUM روی جدول users خوانده می‌شوند
+        """
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name VARCHAR(64) PRIMARY KEY,
+            value BIGINT DEFAULT 0
+        )
+        """,
+        # مقداردهی اولیه یک‌باره از داده‌های موجود
+        """
+        INSERT INTO stats_counters (name, value)
+        SELECT 'total_users', COUNT(*) FROM users
+        WHERE NOT EXISTS (SELECT 1 FROM stats_counters WHERE name = 'total_users')
+        HAVING NOT EXISTS (SELECT 1 FROM stats_counters WHERE name = 'total_users')
+        """,
+        """
+        INSERT INTO stats_counters (name, value)
+        SELECT 'total_downloads', COALESCE(SUM(download_count), 0) FROM users
+        WHERE NOT EXISTS (SELECT 1 FROM stats_counters WHERE name = 'total_downloads')
+        HAVING NOT EXISTS (SELECT 1 FROM stats_counters WHERE name = 'total_downloads')
+        """,
+    ]),
+    (8, 'media groups', [
+        # اعضای پست‌های چندتایی؛ file_id هر عضو جداگانه در file_cache با شناسه خودش است
+        """
+        CREATE TABLE IF NOT EXISTS media_groups (
+            platform VARCHAR(32),
+            media_id VARCHAR(255),
+            format VARCHAR(64),
+            item_ids TEXT NOT NULL,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (platform, media_id, format)
+        )
+        """,
+    ]),
+    (9, 'broadcast job ownership', [
+        # مثل download_jobs: هر کار همگانی فقط در یک نمونه اجرا و با heartbeat تمدید می‌شود
+        "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(128)",
+        "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP",
+    ]),
+]
+
+# کلید pg_advisory_xact_lock تا چند نمونه هم‌زمان migrationها را دو بار اجرا نکنند
+MIGRATION_LOCK_ID = 727310001
+
+
 class Database:
-    def __init__(self):
-        self.connection = None
-        self.connect()
-        if self.connection:  # فقط اگر اتصال موفق بود init_db را صدا بزن
+    def __init__(self, connect=True):
+        self.pool = None
+        self.pool_size = int(os.environ.get('DB_POOL_SIZE', 5))
+        self.pool_timeout = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+        self.connect_timeout = int(os.environ.get('DB_CONNECT_TIMEOUT', 10))
+        self.statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT', 15000))
+        self.reconnect_interval = float(os.environ.get('DB_RECONNECT_INTERVAL', 30))
+
+        # ThreadedConnectionPool در صورت پر بودن خطا می‌دهد؛ سمافور باعث می‌شود منتظر اتصال آزاد بمانیم
+        self.slots = threading.BoundedSemaphore(self.pool_size)
+        self.pool_lock = threading.Lock()
+        self.last_connect_attempt = 0
+
+        # لیست کانال‌های اجباری در حافظه؛ با add_forced_channel یا پس از TTL باطل می‌شود
+        self.forced_channels_ttl = float(os.environ.get('FORCED_CHANNELS_TTL', 300))
+        self.forced_channels_cache = None
+        self.forced_channels_expires = 0
+
+        # با connect=False اتصال و migrationها بعدا با start (مثلا در پس‌زمینه) انجام می‌شوند
+        if connect:
+            self.start()
+
+    def start(self):
+        """اتصال و اجرای migrationها؛ خروجی وضعیت اتصال"""
+        if self.connect():  # فقط اگر اتصال موفق بود init_db را صدا بزن
             self.init_db()
+        return self.is_connected()
+
+    def connection_params(self):
+        params = {
+            'connect_timeout': self.connect_timeout,
+            'options': f'-c statement_timeout={self.statement_timeout}',
+        }
+
+        # در Render از DATABASE_URL استفاده کن
+        database_url = os.environ.get('DATABASE_URL')
+
+        if database_url:
+            # پارس کردن URL برای تنظیمات صحیح
+            parsed_url = urlparse(database_url)
+            params.update(
+                database=parsed_url.path[1:],  # حذف اولین / از مسیر
+                user=parsed_url.username,
+                password=parsed_url.password,
+                host=parsed_url.hostname,
+                port=parsed_url.port,
+                sslmode='require'  # ضروری برای Render
+            )
+        else:
+            # برای توسعه محلی
+            params.update(
+                dbname=os.environ.get('DB_NAME', 'telegram_bot'),
+                user=os.environ.get('DB_USER', 'postgres'),
+                password=os.environ.get('DB_PASSWORD', ''),
+                host=os.environ.get('DB_HOST', 'localhost'),
+                port=os.environ.get('DB_PORT', '5432')
+            )
+        return params
 
     def connect(self):
+        with self.pool_lock:
+            if self.pool:
+                return True
+            self.last_connect_attempt = time.monotonic()
+            try:
+                self.pool = ThreadedConnectionPool(self.pool_size, self.pool_size, **self.connection_params())
+                logging.info(f"✅ Connected to database successfully (pool size {self.pool_size})")
+                return True
+            except Exception as e:
+                logging.error(f"❌ Database connection error: {e}")
+                self.pool = None  # مطمئن شو pool در صورت خطا None است
+                return False
+
+    def is_connected(self):
+        return self.pool is not None
+
+    def ensure_connected(self):
+        """اتصال مجدد خودکار اگر pool ساخته نشده، با فاصله حداقل reconnect_interval بین تلاش‌ها"""
+        if self.pool:
+            return True
+        if time.monotonic() - self.last_connect_attempt < self.reconnect_interval:
+            return False
+        return self.start()
+
+    @contextmanager
+    def get_connection(self):
+        """امانت گرفتن یک اتصال از pool؛ اتصال‌های قطع شده دور انداخته می‌شوند"""
+        if not self.slots.acquire(timeout=self.pool_timeout):
+            raise psycopg2.pool.PoolError("database pool timeout")
+
+        pool = self.pool
+        conn = None
         try:
-            # در Render از DATABASE_URL استفاده کن
-            database_url = os.environ.get('DATABASE_URL')
-            
-            if database_url:
-                # پارس کردن URL برای تنظیمات صحیح
-                parsed_url = urlparse(database_url)
-                
-                self.connection = psycopg2.connect(
-                    database=parsed_url.path[1:],  # حذف اولین / از مسیر
-                    user=parsed_url.username,
-                    password=parsed_url.password,
-                    host=parsed_url.hostname,
-                    port=parsed_url.port,
-                    sslmode='require'  # ضروری برای Render
-                )
-            else:
-                # برای توسعه محلی
-                self.connection = psycopg2.connect(
-                    dbname=os.environ.get('DB_NAME', 'telegram_bot'),
-                    user=os.environ.get('DB_USER', 'postgres'),
-                    password=os.environ.get('DB_PASSWORD', ''),
-                    host=os.environ.get('DB_HOST', 'localhost'),
-                    port=os.environ.get('DB_PORT', '5432')
-                )
-            
-            logging.info("✅ Connected to database successfully")
-            
-        except Exception as e:
-            logging.error(f"❌ Database connection error: {e}")
-            self.connection = None  # مطمئن شو connection None است اگر خطا دارد
+            conn = pool.getconn(key=object())
+            yield conn
+        finally:
+            if conn is not None:
+                pool.putconn(conn, close=bool(conn.closed))
+            self.slots.release()
+
+    def close(self):
+        with self.pool_lock:
+            if self.pool:
+                self.pool.closeall()
+                self.pool = None
 
     def init_db(self):
+        """اجرای migrationهای جدید؛ اگر schema به‌روز باشد فقط یک کوئری خواندنی اجرا می‌شود"""
+        latest = MIGRATIONS[-1][0]
         try:
-            with self.connection.cursor() as cursor:
-                # جدول کاربران
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id BIGINT PRIMARY KEY,
-                        username VARCHAR(255),
-                        first_name VARCHAR(255),
-                        last_name VARCHAR(255),
-                        join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        download_count INTEGER DEFAULT 0
-                    )
-                """)
-                
-                # جدول کانال‌های اجباری
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS forced_channels (
-                        channel_id BIGINT PRIMARY KEY,
-                        channel_username VARCHAR(255),
-                        channel_title VARCHAR(255),
-                        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                self.connection.commit()
-                logging.info("✅ Database tables created successfully")
-                
+            with self.get_connection() as conn, conn.cursor() as cursor:
+                try:
+                    current = self.schema_version(cursor)
+                    if current >= latest:
+                        conn.rollback()
+                        logging.info(f"✅ Database schema is up to date (version {current})")
+                        return
+
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            name VARCHAR(255),
+                            applied_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    """)
+                    # ممکن است نمونه دیگری در زمان انتظار برای قفل migrationها را اجرا کرده باشد
+                    current = self.schema_version(cursor)
+                    for version, name, statements in MIGRATIONS:
+                        if version <= current:
+                            continue
+                        for statement in statements:
+                            cursor.execute(statement)
+                        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                        logging.info(f"✅ Applied database migration {version}: {name}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
         except Exception as e:
             logging.error(f"❌ Database initialization error: {e}")
 
+    def schema_version(self, cursor):
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cursor.fetchone()[0]
+
     def execute_query(self, query, params=None):
-        """متد عمومی برای اجرای کوئری‌ها"""
-        if not self.connection:
+        """متد عمومی برای اجرای کوئری‌ها؛ در صورت قطع اتصال با اتصال تازه دوباره تلاش می‌کند"""
+        if not self.ensure_connected():
             logging.error("❌ No database connection")
             return None
-            
-        try:
-            cursor = self.connection.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            if query.strip().upper().startswith('SELECT'):
-                result = cursor.fetchall()
-                cursor.close()
-                return result
-            else:
-                self.connection.commit()
-                cursor.close()
-                return True
-                
-        except Exception as e:
-            logging.error(f"❌ Query execution error: {e}")
-            if self.connection:
-                self.connection.rollback()
-            return None
+
+        # هر تلاش ناموفق یک اتصال مرده را از pool خارج می‌کند؛ پس حداکثر به اندازه pool دوباره تلاش می‌کنیم
+        for attempt in range(self.pool_size + 1):
+            conn = None
+            try:
+                with self.get_connection() as conn:
+                    try:
+                        with conn.cursor() as cursor:
+                            if params:
+                                cursor.execute(query, params)
+                            else:
+                                cursor.execute(query)
+
+                            result = cursor.fetchall() if cursor.description is not None else True
+
+                        conn.commit()
+                        return result
+
+                    except Exception:
+                        if not conn.closed:
+                            conn.rollback()
+                        raise
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # فقط اگر خود اتصال قطع شده دوباره تلاش کن (نه مثلا برای statement timeout)
+                if conn is not None and conn.closed and attempt < self.pool_size:
+                    logging.warning(f"⚠️ Database connection lost, retrying: {e}")
+                    continue
+                DB_ERRORS.inc()
+                logging.error(f"❌ Query execution error: {e}")
+                return None
+            except Exception as e:
+                DB_ERRORS.inc()
+                logging.error(f"❌ Query execution error: {e}")
+                return None
 
     # متدهای دیگر با استفاده از execute_query
+    # ثبت کاربر و شمارنده دانلود از مسیر دسته‌ای WriteBuffer و flush_writes انجام می‌شود
     def add_user(self, user_id, username, first_name, last_name):
-        query = """
-            INSERT INTO users (user_id, username, first_name, last_name)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET
-            username = EXCLUDED.username,
-            first_name = EXCLUDED.first_name,
-            last_name = EXCLUDED.last_name
-        """
-        return self.execute_query(query, (user_id, username, first_name, last_name))
+        """upsert تکی بدون بافر؛ مسیر اصلی WriteBehindBuffer است که همین دستور را دسته‌ای اجرا می‌کند"""
+        return self.flush_writes({user_id: (username, first_name, last_name)}, {})
 
     def increment_download_count(self, user_id):
-        query = """
-            UPDATE users SET download_count = download_count + 1
-            WHERE user_id = %s
-        """
-        return self.execute_query(query, (user_id,))
+        return self.flush_writes({}, {user_id: 1})
+
+    def flush_writes(self, users, counters, events=()):
+        """نوشتن دسته‌ای upsert کاربران، شمارنده‌ها، رویدادهای دانلود و آمار تجمیعی در یک تراکنش"""
+        if not self.ensure_connected():
+            return False
+
+        try:
+            with self.get_connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        totals = {}
+
+                        if users:
+                            rows = execute_values(cursor, """
+                                INSERT INTO users (user_id, username, first_name, last_name)
+                                VALUES %s
+                                ON CONFLICT (user_id) DO UPDATE SET
+                                username = EXCLUDED.username,
+                                first_name = EXCLUDED.first_name,
+                                last_name = EXCLUDED.last_name,
+                                is_blocked = FALSE
+                                RETURNING (xmax = 0)
+                            """, [(user_id, *values) for user_id, values in users.items()],
+                                page_size=1000, fetch=True)
+                            # xmax = 0 یعنی ردیف تازه درج شده، نه به‌روزرسانی
+                            totals['total_users'] = sum(1 for (inserted,) in rows if inserted)
+
+                        if counters:
+                            execute_values(cursor, """
+                                UPDATE users SET download_count = users.download_count + v.delta
+                                FROM (VALUES %s) AS v(user_id, delta)
+                                WHERE users.user_id = v.user_id
+                            """, list(counters.items()), template="(%s::BIGINT, %s::INTEGER)", page_size=1000)
+                            totals['total_downloads'] = sum(counters.values())
+
+                        if events:
+                            execute_values(cursor, """
+                                INSERT INTO download_events
+                                (user_id, platform, bytes, duration_ms, cache_hit, status, created_at)
+                                VALUES %s
+                            """, list(events), page_size=1000)
+                            self.update_rollups(cursor, events)
+                            totals['total_bytes'] = sum(event[2] for event in events if event[5] == 'success')
+
+                        totals = [(name, value) for name, value in totals.items() if value]
+                        if totals:
+                            execute_values(cursor, """
+                                INSERT INTO stats_counters (name, value) VALUES %s
+                                ON CONFLICT (name) DO UPDATE SET
+                                value = stats_counters.value + EXCLUDED.value
+                            """, totals)
+
+                    conn.commit()
+                    return True
+
+                except Exception:
+                    if not conn.closed:
+                        conn.rollback()
+                    raise
+
+        except Exception as e:
+            DB_ERRORS.inc()
+            logging.error(f"❌ Batch write error: {e}")
+            return False
+
+    def update_rollups(self, cursor, events):
+        """افزودن رویدادها به جدول‌های تجمیع ساعتی و روزانه"""
+        for table, truncate in (
+            ('download_stats_hourly', lambda ts: ts.replace(minute=0, second=0, microsecond=0)),
+            ('download_stats_daily', lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0)),
+        ):
+            buckets = {}
+            for user_id, platform, size, duration_ms, cache_hit, status, created_at in events:
+                key = (truncate(created_at), platform, status)
+                row = buckets.setdefault(key, [0, 0, 0, 0])
+                row[0] += 1
+                row[1] += size
+                row[2] += 1 if cache_hit else 0
+                row[3] += duration_ms
+
+            execute_values(cursor, f"""
+                INSERT INTO {table} (bucket, platform, status, downloads, bytes, cache_hits, duration_ms)
+                VALUES %s
+                ON CONFLICT (bucket, platform, status) DO UPDATE SET
+                downloads = {table}.downloads + EXCLUDED.downloads,
+                bytes = {table}.bytes + EXCLUDED.bytes,
+                cache_hits = {table}.cache_hits + EXCLUDED.cache_hits,
+                duration_ms = {table}.duration_ms + EXCLUDED.duration_ms
+            """, [(*key, *values) for key, values in buckets.items()])
 
     def add_forced_channel(self, channel_id, channel_username, channel_title):
         query = """
@@ -130,26 +489,373 @@ class Database:
             channel_username = EXCLUDED.channel_username,
             channel_title = EXCLUDED.channel_title
         """
-        return self.execute_query(query, (channel_id, channel_username, channel_title))
+        result = self.execute_query(query, (channel_id, channel_username, channel_title))
+        if result:
+            self.forced_channels_cache = None
+        return result
 
     def get_forced_channels(self):
-        query = "SELECT * FROM forced_channels"
+        channels = self.forced_channels_cache
+        if channels is not None and time.monotonic() < self.forced_channels_expires:
+            return channels
+
+        query = "SELECT channel_id, channel_username, channel_title FROM forced_channels ORDER BY added_date"
         result = self.execute_query(query)
-        return result if result else []
+        if result is None:
+            return channels or []
+
+        channels = [
+            {'channel_id': row[0], 'channel_username': row[1], 'channel_title': row[2]}
+            for row in result
+        ]
+        self.forced_channels_cache = channels
+        self.forced_channels_expires = time.monotonic() + self.forced_channels_ttl
+        return channels
 
     def get_all_users(self):
         query = "SELECT user_id FROM users"
         result = self.execute_query(query)
         return [row[0] for row in result] if result else []
 
+    def iter_user_batches(self, after_user_id=0, batch_size=1000):
+        """پیمایش شناسه کاربران فعال به ترتیب user_id با cursor سمت سرور، دسته به دسته"""
+        if not self.ensure_connected():
+            logging.error("❌ No database connection")
+            # لیست خالی یعنی پایان کاربران و کار همگانی را تمام شده ثبت می‌کرد
+            raise psycopg2.OperationalError("no database connection")
+
+        with self.get_connection() as conn:
+            try:
+                with conn.cursor(name='broadcast_users') as cursor:
+                    cursor.itersize = batch_size
+                    cursor.execute("""
+                        SELECT user_id FROM users
+                        WHERE user_id > %s AND NOT COALESCE(is_blocked, FALSE)
+                        ORDER BY user_id
+                    """, (after_user_id,))
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield [row[0] for row in rows]
+            finally:
+                if not conn.closed:
+                    conn.rollback()
+
+    def count_active_users(self, after_user_id=0):
+        query = "SELECT COUNT(*) FROM users WHERE user_id > %s AND NOT COALESCE(is_blocked, FALSE)"
+        result = self.execute_query(query, (after_user_id,))
+        return result[0][0] if result else 0
+
+    def mark_users_blocked(self, user_ids):
+        query = "UPDATE users SET is_blocked = TRUE WHERE user_id = ANY(%s)"
+        return self.execute_query(query, (list(user_ids),))
+
+    def create_broadcast_job(self, admin_chat_id, from_chat_id, message_id, total, worker_id):
+        query = """
+            INSERT INTO broadcast_jobs (admin_chat_id, from_chat_id, message_id, total, worker_id, heartbeat_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            RETURNING job_id
+        """
+        result = self.execute_query(query, (admin_chat_id, from_chat_id, message_id, total, worker_id))
+        return result[0][0] if result else None
+
+    def claim_broadcast_job(self, worker_id, visibility_timeout):
+        """برداشتن یک کار همگانی نیمه‌تمام که heartbeat صاحبش منقضی شده؛ بدون قفل شدن نمونه‌های دیگر"""
+        query = """
+            UPDATE broadcast_jobs SET worker_id = %s, heartbeat_at = NOW()
+            WHERE job_id = (
+                SELECT job_id FROM broadcast_jobs
+                WHERE status = 'running'
+                AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - %s * INTERVAL '1 second')
+                ORDER BY job_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING job_id, admin_chat_id, from_chat_id, message_id, progress_message_id,
+            last_user_id, total, sent, failed, blocked
+        """
+        result = self.execute_query(query, (worker_id, visibility_timeout))
+        return result[0] if result else None
+
+    def heartbeat_broadcast_job(self, job_id, worker_id):
+        """تمدید مالکیت کار همگانی؛ اگر کار به نمونه دیگری رسیده باشد False و در خطای دیتابیس None"""
+        query = """
+            UPDATE broadcast_jobs SET heartbeat_at = NOW()
+            WHERE job_id = %s AND worker_id = %s AND status = 'running'
+            RETURNING job_id
+        """
+        result = self.execute_query(query, (job_id, worker_id))
+        return None if result is None else bool(result)
+
+    def release_broadcast_job(self, job_id, worker_id):
+        """رها کردن کار هنگام خاموش شدن تا نمونه دیگری بدون انتظار ادامه‌اش دهد"""
+        query = """
+            UPDATE broadcast_jobs SET worker_id = NULL, heartbeat_at = NULL
+            WHERE job_id = %s AND worker_id = %s AND status = 'running'
+        """
+        return self.execute_query(query, (job_id, worker_id))
+
+    def update_broadcast_job(self, job_id, worker_id, last_user_id, sent, failed, blocked,
+                             progress_message_id=None, status='running'):
+        """ذخیره پیشرفت فقط توسط صاحب فعلی کار؛ خروجی مثل heartbeat_broadcast_job"""
+        query = """
+            UPDATE broadcast_jobs SET
+            last_user_id = %s, sent = %s, failed = %s, blocked = %s,
+            progress_message_id = COALESCE(%s, progress_message_id), status = %s, heartbeat_at = NOW()
+            WHERE job_id = %s AND worker_id = %s
+            RETURNING job_id
+        """
+        result = self.execute_query(query, (last_user_id, sent, failed, blocked,
+                                            progress_message_id, status, job_id, worker_id))
+        return None if result is None else bool(result)
+
     def get_statistics(self):
+        """آمار از شمارنده‌ها و جدول‌های تجمیعی؛ زمان اجرا به تعداد کاربران بستگی ندارد"""
+        stats = {'total_users': 0, 'total_downloads': 0, 'total_bytes': 0, 'platforms': [], 'daily': []}
+
+        result = self.execute_query("SELECT name, value FROM stats_counters")
+        if result:
+            stats.update({name: value for name, value in result})
+
+        # آمار ۲۴ ساعت گذشته به تفکیک پلتفرم
+        result = self.execute_query("""
+            SELECT platform,
+                   COALESCE(SUM(downloads) FILTER (WHERE status = 'success'), 0),
+                   COALESCE(SUM(downloads) FILTER (WHERE status <> 'success'), 0),
+                   COALESCE(SUM(bytes), 0),
+                   COALESCE(SUM(cache_hits), 0),
+                   COALESCE(SUM(duration_ms) FILTER (WHERE status = 'success'), 0)
+            FROM download_stats_hourly
+            WHERE bucket >= date_trunc('hour', (NOW() AT TIME ZONE 'UTC') - INTERVAL '23 hours')
+            GROUP BY platform
+            ORDER BY platform
+        """)
+        if result:
+            stats['platforms'] = [
+                {'platform': row[0], 'success': row[1], 'failed': row[2], 'bytes': row[3],
+                 'cache_hits': row[4], 'duration_ms': row[5]}
+                for row in result
+            ]
+
+        # روند دانلودهای موفق هفت روز اخیر
+        result = self.execute_query("""
+            SELECT bucket::date, SUM(downloads)
+            FROM download_stats_daily
+            WHERE status = 'success'
+            AND bucket >= date_trunc('day', (NOW() AT TIME ZONE 'UTC') - INTERVAL '6 days')
+            GROUP BY bucket
+            ORDER BY bucket
+        """)
+        if result:
+            stats['daily'] = [(str(day), downloads) for day, downloads in result]
+
+        return stats
+
+    def get_cached_file(self, platform, media_id, fmt):
         query = """
-            SELECT 
-                COUNT(*) as total_users,
-                COALESCE(SUM(download_count), 0) as total_downloads
-            FROM users
+            SELECT file_id FROM file_cache
+            WHERE platform = %s AND media_id = %s AND format = %s
         """
-        result = self.execute_query(query)
-        if result and len(result) > 0:
-            return {'total_users': result[0][0], 'total_downloads': result[0][1]}
-        return {'total_users': 0, 'total_downloads': 0}
+        result = self.execute_query(query, (platform, media_id, fmt))
+        return result[0][0] if result else None
+
+    def save_cached_file(self, platform, media_id, fmt, file_id):
+        query = """
+            INSERT INTO file_cache (platform, media_id, format, file_id)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (platform, media_id, format) DO UPDATE SET
+            file_id = EXCLUDED.file_id,
+            created_date = CURRENT_TIMESTAMP
+        """
+        return self.execute_query(query, (platform, media_id, fmt, file_id))
+
+    def delete_cached_file(self, platform, media_id, fmt):
+        query = """
+            DELETE FROM media_groups
+            WHERE platform = %s AND media_id = %s AND format = %s
+        """
+        self.execute_query(query, (platform, media_id, fmt))
+        query = """
+            DELETE FROM file_cache
+            WHERE platform = %s AND media_id = %s AND format = %s
+        """
+        return self.execute_query(query, (platform, media_id, fmt))
+
+    def clear_file_cache(self):
+        self.execute_query("DELETE FROM media_groups")
+        return self.execute_query("DELETE FROM file_cache")
+
+    def get_media_group(self, platform, media_id, fmt):
+        query = """
+            SELECT item_ids FROM media_groups
+            WHERE platform = %s AND media_id = %s AND format = %s
+        """
+        result = self.execute_query(query, (platform, media_id, fmt))
+        return result[0][0].split(',') if result else None
+
+    def save_media_group(self, platform, media_id, fmt, item_ids):
+        query = """
+            INSERT INTO media_groups (platform, media_id, format, item_ids)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (platform, media_id, format) DO UPDATE SET
+            item_ids = EXCLUDED.item_ids,
+            created_date = CURRENT_TIMESTAMP
+        """
+        return self.execute_query(query, (platform, media_id, fmt, ','.join(item_ids)))
+
+    def enqueue_download_job(self, user_id, chat_id, status_message_id, url, priority=False):
+        query = """
+            INSERT INTO download_jobs (user_id, chat_id, status_message_id, url, priority)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING job_id
+        """
+        result = self.execute_query(query, (user_id, chat_id, status_message_id, url, priority))
+        return result[0][0] if result else None
+
+    def get_download_queue_state(self, user_id, priority=False):
+        """(تعداد کارهای جلوتر در صف برای یک کار جدید، تعداد کارهای فعال کاربر)"""
+        query = """
+            SELECT COUNT(*) FILTER (WHERE status = 'queued' AND (priority OR NOT %s)),
+                   COUNT(*) FILTER (WHERE user_id = %s)
+            FROM download_jobs WHERE status IN ('queued', 'running')
+        """
+        result = self.execute_query(query, (priority, user_id))
+        return (result[0][0], result[0][1]) if result else (0, 0)
+
+    def claim_download_job(self, worker_id, visibility_timeout):
+        """برداشتن یک کار در صف، یا کاری که heartbeat ورکرش منقضی شده؛ بدون قفل شدن ورکرهای دیگر
+
+        مثل DownloadQueue نوبت چرخشی بین کاربران است: کارها به ترتیب تعداد کارهای قدیمی‌تر همان کاربر
+        که هنوز در صف یا در حال اجرا هستند برداشته می‌شوند، پس کاربری با صف طولانی بقیه را منتظر نمی‌گذارد.
+        """
+        query = """
+            UPDATE download_jobs SET
+            status = 'running', worker_id = %s, heartbeat_at = NOW(), attempts = attempts + 1
+            WHERE job_id = (
+                SELECT job_id FROM download_jobs AS job
+                WHERE status = 'queued'
+                OR (status = 'running' AND heartbeat_at < NOW() - %s * INTERVAL '1 second')
+                ORDER BY priority DESC, (
+                    SELECT COUNT(*) FROM download_jobs AS earlier
+                    WHERE earlier.user_id = job.user_id AND earlier.status IN ('queued', 'running')
+                    AND earlier.job_id < job.job_id
+                ), job_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING job_id, user_id, chat_id, status_message_id, url, priority, attempts,
+            EXTRACT(EPOCH FROM NOW() - created_date)
+        """
+        result = self.execute_query(query, (worker_id, visibility_timeout))
+        if not result:
+            return None
+        columns = ('job_id', 'user_id', 'chat_id', 'status_message_id', 'url', 'priority', 'attempts', 'waited')
+        job = dict(zip(columns, result[0]))
+        job['waited'] = float(job['waited'] or 0)
+        return job
+
+    def heartbeat_download_job(self, job_id, worker_id):
+        """تمدید مالکیت کار؛ اگر کار به ورکر دیگری رسیده باشد False و در خطای دیتابیس None"""
+        query = """
+            UPDATE download_jobs SET heartbeat_at = NOW()
+            WHERE job_id = %s AND worker_id = %s AND status = 'running'
+            RETURNING job_id
+        """
+        result = self.execute_query(query, (job_id, worker_id))
+        return None if result is None else bool(result)
+
+    def finish_download_job(self, job_id, worker_id, status, error=None):
+        query = """
+            UPDATE download_jobs SET status = %s, error = %s, finished_date = NOW()
+            WHERE job_id = %s AND worker_id = %s
+        """
+        return self.execute_query(query, (status, error, job_id, worker_id))
+
+    def requeue_download_job(self, job_id, worker_id):
+        """برگرداندن کار نیمه‌کاره به صف هنگام خاموش شدن ورکر"""
+        query = """
+            UPDATE download_jobs SET
+            status = 'queued', worker_id = NULL, heartbeat_at = NULL, attempts = GREATEST(attempts - 1, 0)
+            WHERE job_id = %s AND worker_id = %s AND status = 'running'
+        """
+        return self.execute_query(query, (job_id, worker_id))
+
+    def prune_download_jobs(self, max_age):
+        query = """
+            DELETE FROM download_jobs
+            WHERE status IN ('done', 'failed') AND finished_date < NOW() - %s * INTERVAL '1 second'
+        """
+        return self.execute_query(query, (max_age,))
+
+    def get_conversation_state(self, user_id, max_age):
+        query = """
+            SELECT state FROM conversation_state
+            WHERE user_id = %s AND updated_date > NOW() - %s * INTERVAL '1 second'
+        """
+        result = self.execute_query(query, (user_id, max_age))
+        return result[0][0] if result else None
+
+    def set_conversation_state(self, user_id, state):
+        query = """
+            INSERT INTO conversation_state (user_id, state)
+            VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+            state = EXCLUDED.state,
+            updated_date = CURRENT_TIMESTAMP
+        """
+        return self.execute_query(query, (user_id, state))
+
+    def clear_conversation_state(self, user_id):
+        return self.execute_query("DELETE FROM conversation_state WHERE user_id = %s", (user_id,))
+
+
+class AsyncDatabase:
+    """نسخه awaitable متدهای Database؛ هر فراخوانی در thread pool جداگانه اجرا می‌شود تا event loop منتظر دیتابیس نماند"""
+
+    def __init__(self, database):
+        self.sync = database
+        self.executor = ThreadPoolExecutor(max_workers=database.pool_size, thread_name_prefix='database')
+
+    def is_connected(self):
+        return self.sync.is_connected()
+
+    async def iterate(self, iterator):
+        """پیمایش یک generator دیتابیس (مثل cursor سمت سرور) بدون مسدود کردن event loop"""
+        loop = asyncio.get_running_loop()
+        done = object()
+        pending = None
+
+        def close():
+            # لغو فقط انتظار را قطع می‌کند و next در thread ادامه دارد؛ close روی generator در حال اجرا
+            # ValueError می‌داد و cursor و اتصال pool هرگز آزاد نمی‌شدند
+            if pending is not None:
+                concurrent.futures.wait([pending])
+            iterator.close()
+
+        try:
+            while True:
+                pending = self.executor.submit(next, iterator, done)
+                item = await asyncio.wrap_future(pending)
+                if item is done:
+                    break
+                yield item
+        finally:
+            await loop.run_in_executor(self.executor, close)
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # زمان شامل انتظار برای executor و pool اتصال است
+            with DB_SECONDS.time(method=name):
+                return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+        return call
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.sync.close()
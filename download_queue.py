@@ -0,0 +1,241 @@
+import os
+import math
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import UserRateLimiter
+from metrics import QUEUE_WAIT_SECONDS
+
+
+class DownloadJob:
+    def __init__(self, user_id, url, future, priority=False):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.url = url
+        self.future = future
+        self.priority = priority
+        self.output_dir = None
+        self.on_start = None  # کال‌بک async که هنگام شروع دانلود صدا زده می‌شود
+        self.progress = None  # progress hook دانلود که در thread ورکر صدا زده می‌شود
+        # زمان‌ها (perf_counter) برای متریک و trace درخواست
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+
+
+class DownloadQueue:
+    """زمان‌بند منصفانه دانلود: صف جدا برای هر کاربر، نوبت‌دهی چرخشی بین کاربران و مسیر اولویت‌دار ادمین‌ها
+
+    دانلودها در ورکرها و خارج از event loop اجرا می‌شوند.
+    """
+
+    def __init__(self, downloader):
+        self.downloader = downloader
+        self.workers = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+        self.max_queue_size = int(os.environ.get('DOWNLOAD_QUEUE_SIZE', 100))
+        self.per_user_limit = int(os.environ.get('DOWNLOAD_PER_USER_LIMIT', 2))
+        self.per_user_in_flight = int(os.environ.get('DOWNLOAD_PER_USER_IN_FLIGHT', 1))
+        # به طور پیش‌فرض هر کاربر حداکثر ۵ درخواست پشت سر هم و سپس یکی هر ۱۰ ثانیه
+        self.rate_limiter = UserRateLimiter(
+            rate=float(os.environ.get('USER_REQUEST_RATE', 0.1)),
+            capacity=float(os.environ.get('USER_REQUEST_BURST', 5))
+        )
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download')
+        self.priority = deque()  # کارهای ادمین‌ها که قبل از بقیه اجرا می‌شوند
+        self.waiting = {}  # user_id -> deque کارهای در انتظار آن کاربر
+        self.rotation = deque()  # ترتیب نوبت چرخشی کاربرانی که کار در انتظار دارند
+        self.running = {}  # user_id -> تعداد دانلودهای در حال اجرای کاربر
+        self.user_jobs = {}  # تعداد کارهای فعال (در صف یا در حال اجرا) هر کاربر
+        self.queued = 0
+        self.active = 0  # تعداد ورکرهای مشغول
+        self.ready = None
+        self.warmup = None
+        self.worker_tasks = []
+
+    async def start(self, warmup=None):
+        """warmup: future آماده‌سازی دانلودر؛ تا کامل شدنش کارها پذیرفته و در صف نگه داشته می‌شوند"""
+        self.ready = asyncio.Condition()
+        self.warmup = warmup
+        self.worker_tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        logging.info(f"✅ Download queue started with {self.workers} workers")
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+        for job in self.pending_jobs():
+            job.future.cancel()
+        self.priority.clear()
+        self.waiting.clear()
+        self.rotation.clear()
+        self.queued = 0
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def pending_jobs(self):
+        jobs = list(self.priority)
+        for queue in self.waiting.values():
+            jobs.extend(queue)
+        return jobs
+
+    def admission_error(self, user_id, priority, user_jobs, queued):
+        """بررسی محدودیت نرخ، سهمیه کاربر و ظرفیت صف؛ پیام خطا یا None"""
+        if not priority:
+            allowed, retry_after = self.rate_limiter.allow(user_id)
+            if not allowed:
+                return (f"🐢 درخواست‌های شما بیش از حد سریع است. "
+                        f"لطفا {math.ceil(retry_after)} ثانیه دیگر دوباره تلاش کنید.")
+
+            if user_jobs >= self.per_user_limit:
+                return f"شما در حال حاضر {self.per_user_limit} دانلود فعال دارید. لطفا صبر کنید."
+
+        if queued >= self.max_queue_size:
+            return "صف دانلود پر است. لطفا چند لحظه دیگر تلاش کنید."
+        return None
+
+    def submit(self, user_id, url, priority=False):
+        """افزودن یک دانلود به صف؛ خروجی (job, error) است"""
+        error = self.admission_error(user_id, priority, self.user_jobs.get(user_id, 0), self.queued)
+        if error:
+            return None, error
+
+        job = DownloadJob(user_id, url, asyncio.get_running_loop().create_future(), priority)
+        if priority:
+            self.priority.append(job)
+        else:
+            queue = self.waiting.get(user_id)
+            if queue is None:
+                queue = self.waiting[user_id] = deque()
+                self.rotation.append(user_id)
+            queue.append(job)
+
+        self.queued += 1
+        self.user_jobs[user_id] = self.user_jobs.get(user_id, 0) + 1
+        self.notify()
+        return job, None
+
+    def notify(self):
+        async def wake():
+            async with self.ready:
+                self.ready.notify_all()
+        asyncio.get_running_loop().create_task(wake())
+
+    def next_job(self):
+        """انتخاب کار بعدی: اول صف اولویت، سپس نوبت چرخشی بین کاربرانی که به سقف هم‌زمانی نرسیده‌اند"""
+        if self.priority:
+            self.queued -= 1
+            return self.priority.popleft()
+
+        for _ in range(len(self.rotation)):
+            user_id = self.rotation[0]
+            self.rotation.rotate(-1)
+            if self.running.get(user_id, 0) >= self.per_user_in_flight:
+                continue
+
+            queue = self.waiting[user_id]
+            job = queue.popleft()
+            if not queue:
+                del self.waiting[user_id]
+                self.rotation.remove(user_id)
+            self.queued -= 1
+            return job
+        return None
+
+    def position(self, job):
+        """جایگاه تقریبی کار در صف انتظار؛ صفر یعنی یک ورکر آزاد بلافاصله آن را اجرا می‌کند"""
+        if job.priority:
+            try:
+                ahead = self.priority.index(job)
+            except ValueError:
+                return 0
+        else:
+            queue = self.waiting.get(job.user_id)
+            if not queue or job not in queue:
+                return 0
+            rank = queue.index(job) + 1
+            # در نوبت چرخشی، کاربرانی که جلوتر در چرخش هستند تا rank کار و بقیه تا rank - 1 کار جلوتر اجرا می‌شوند
+            ahead = len(self.priority) + rank - 1
+            before = True
+            for user_id in self.rotation:
+                if user_id == job.user_id:
+                    before = False
+                    continue
+                ahead += min(len(self.waiting[user_id]), rank if before else rank - 1)
+        idle = self.workers - self.active
+        return max(0, ahead + 1 - idle)
+
+    def cancel(self, job):
+        """حذف کاری که هنوز شروع نشده و لغو future آن؛ خروجی False اگر کار در حال اجرا یا تمام شده باشد"""
+        queue = self.priority if job.priority else self.waiting.get(job.user_id)
+        if not queue or job not in queue:
+            return False
+        queue.remove(job)
+        if not job.priority and not queue:
+            del self.waiting[job.user_id]
+            self.rotation.remove(job.user_id)
+        self.queued -= 1
+        job.future.cancel()
+        return True
+
+    def release(self, job):
+        """آزاد کردن سهمیه کاربر؛ پاکسازی پوشه کار به عهده صاحب فایل است"""
+        count = self.user_jobs.get(job.user_id, 0) - 1
+        if count > 0:
+            self.user_jobs[job.user_id] = count
+        else:
+            self.user_jobs.pop(job.user_id, None)
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        if self.warmup:
+            # خطای آماده‌سازی مانع کار ورکرها نیست؛ فقط اولین دانلود کندتر می‌شود
+            await asyncio.wait([self.warmup])
+        while True:
+            async with self.ready:
+                job = self.next_job()
+                while job is None:
+                    await self.ready.wait()
+                    job = self.next_job()
+
+            self.active += 1
+            self.running[job.user_id] = self.running.get(job.user_id, 0) + 1
+            job.started_at = time.perf_counter()
+            QUEUE_WAIT_SECONDS.observe(job.started_at - job.submitted_at)
+            try:
+                if job.on_start:
+                    try:
+                        await job.on_start()
+                    except Exception as e:
+                        logging.error(f"Job start callback error: {e}")
+
+                job.output_dir = self.downloader.create_job_dir(job.job_id)
+                result = await loop.run_in_executor(
+                    self.executor, self.downloader.download_media, job.url, job.output_dir,
+                    job.priority, job.started_at - job.submitted_at, job.progress
+                )
+                # درخواستی که منتظر نتیجه بود ممکن است لغو شده و future را هم لغو کرده باشد
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                logging.error(f"Download worker error: {e}")
+                if not job.future.done():
+                    job.future.set_result((None, f"خطا در دانلود: {str(e)}"))
+            finally:
+                job.finished_at = time.perf_counter()
+                self.active -= 1
+                count = self.running.get(job.user_id, 0) - 1
+                if count > 0:
+                    self.running[job.user_id] = count
+                else:
+                    self.running.pop(job.user_id, None)
+                # کار بعدی همین کاربر اکنون مجاز است
+                self.notify()
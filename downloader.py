@@ -1,64 +1,347 @@
 import os
-import yt_dlp
-import requests
+import copy
+import time
+import threading
 import logging
-from urllib.parse import urlparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from ydl_pool import YoutubeDLPool, load_yt_dlp
+from postprocess import PostProcessor
+from staging import StagingArea
+from bandwidth import BandwidthScheduler
+from url_parser import parse_link
+from uploader import default_max_upload_size
+from metrics import PROBE_SECONDS, PROBE_CACHE, DOWNLOAD_SECONDS, DOWNLOADED_BYTES, DOWNLOAD_RESUMES
+
+# یک عضو پست چندتایی (carousel)؛ media_id شناسه خود عضو برای کش جداگانه
+MediaItem = namedtuple('MediaItem', ['media_id', 'file_path'])
 
 
 class Downloader:
     def __init__(self):
         self.download_path = "downloads"
-        if not os.path.exists(self.download_path):
-            os.makedirs(self.download_path)
+        self.youtube_format = 'best[height<=720]'  # پروفایل کیفیت در کلید کش
+        self.instagram_format = 'best'
+        self.youtube_max_height = 720
+        self.max_upload_size = int(os.environ.get('MAX_UPLOAD_SIZE', default_max_upload_size()))
+
+        self.probe_ttl = float(os.environ.get('PROBE_CACHE_TTL', 600))
+        self.probe_cache_size = int(os.environ.get('PROBE_CACHE_SIZE', 500))
+        self.probe_cache = {}  # url -> (expires_at, info)
+        self.probe_lock = threading.Lock()
+
+        # نمونه‌های YoutubeDL بین درخواست‌ها بازاستفاده می‌شوند
+        self.ydl_pool = YoutubeDLPool()
+        self.postprocessor = PostProcessor(self.max_upload_size)
+        # فضای موقت با سقف حجم؛ باقی‌مانده اجراهای قبلی همین‌جا پاک می‌شود
+        self.staging = StagingArea(self.download_path)
+        # تقسیم پهنای باند بین دانلودهای هم‌زمان و ادامه فایل نیمه‌کاره پس از خطای گذرا
+        self.bandwidth = BandwidthScheduler()
+        self.resume_attempts = int(os.environ.get('DOWNLOAD_RESUME_ATTEMPTS', 2))
+        self.resume_delay = float(os.environ.get('DOWNLOAD_RESUME_DELAY', 2))
+        # اعضای پست‌های چندتایی هم‌زمان دانلود می‌شوند
+        self.entry_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('CAROUSEL_CONCURRENCY', 4)),
+                                                 thread_name_prefix='carousel')
+
+    def warmup(self):
+        try:
+            self.ydl_pool.warmup(('youtube', 'instagram'))
+        except Exception as e:
+            logging.error(f"YoutubeDL warmup error: {e}")
 
     def is_youtube_url(self, url):
-        return any(domain in url for domain in ['youtube.com', 'youtu.be'])
+        link = parse_link(url)
+        return link is not None and link.platform == 'youtube'
 
     def is_instagram_url(self, url):
-        return 'instagram.com' in url
+        link = parse_link(url)
+        return link is not None and link.platform == 'instagram'
 
-    def download_media(self, url):
+    def get_media_key(self, link):
+        """کلید یکتای مدیا (platform, media_id, format) برای کش و ادغام درخواست‌ها"""
+        if link.kind == 'playlist':
+            return None
+        fmt = self.youtube_format if link.platform == 'youtube' else self.instagram_format
+        return (link.platform, link.media_id, fmt)
+
+    def create_job_dir(self, job_id):
+        """پوشه اختصاصی هر کار تا فایل‌های هم‌نام دو دانلود با هم تداخل نداشته باشند"""
+        return self.staging.create(job_id)
+
+    def download_media(self, url, output_dir=None, priority=False, waited=0, progress=None):
+        """خروجی (file_path, error)؛ برای پست‌های چندتایی به جای مسیر، لیستی از MediaItem"""
+        platform = self.get_platform(url)
+        started = time.perf_counter()
+        file_path, error = self.fetch_media(url, output_dir, priority, waited, progress)
+
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - started, platform=platform,
+                                 outcome='failed' if error else 'success')
+        if file_path:
+            DOWNLOADED_BYTES.inc(self.media_size(file_path), platform=platform)
+        return file_path, error
+
+    def media_size(self, media):
+        """حجم فایل یا مجموع حجم اعضای یک پست چندتایی"""
+        paths = [item.file_path for item in media] if isinstance(media, list) else [media]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def fetch_media(self, url, output_dir=None, priority=False, waited=0, progress=None):
+        output_dir = output_dir or self.download_path
         try:
+            link = parse_link(url)
+            if link and link.kind == 'playlist':
+                return None, "دانلود پلی‌لیست پشتیبانی نمی‌شود؛ لینک یک ویدیو را ارسال کنید"
+
+            # فایل همین لینک که اخیرا دانلود شده و هنوز روی دیسک نگه داشته شده
+            reused = self.staging.reuse(url, output_dir)
+            if reused:
+                self.staging.commit(output_dir)
+                return reused, None
             if self.is_youtube_url(url):
-                return self.download_youtube(url)
+                return self.download_youtube(url, output_dir, priority, waited, progress)
             elif self.is_instagram_url(url):
-                return self.download_instagram(url)
+                return self.download_instagram(url, output_dir, priority, waited, progress)
             else:
                 return None, "لینک ارائه شده پشتیبانی نمی‌شود"
         except Exception as e:
             logging.error(f"Download error: {e}")
             return None, f"خطا در دانلود: {str(e)}"
 
-    def download_youtube(self, url):
-        try:
-            ydl_opts = {
-                'format': 'best[height<=720]',
-                'outtmpl': os.path.join(self.download_path, '%(title)s.%(ext)s'),
-                'quiet': True,
-            }
+    def get_platform(self, url):
+        link = parse_link(url)
+        return link.platform if link else 'generic'
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+    def probe(self, url):
+        """دریافت اطلاعات مدیا بدون دانلود، با کش TTL"""
+        now = time.monotonic()
+        with self.probe_lock:
+            cached = self.probe_cache.get(url)
+            if cached and cached[0] > now:
+                PROBE_CACHE.inc(result='hit')
+                return cached[1]
 
-                return filename, None
+        PROBE_CACHE.inc(result='miss')
+        platform = self.get_platform(url)
+        with PROBE_SECONDS.time(platform=platform):
+            with self.ydl_pool.lease(platform, probe=True) as ydl:
+                info = ydl.extract_info(url, download=False)
 
-        except Exception as e:
-            return None, f"خطا در دانلود از یوتیوب: {str(e)}"
+        with self.probe_lock:
+            if len(self.probe_cache) >= self.probe_cache_size:
+                # حذف آیتم‌های منقضی و در صورت نیاز قدیمی‌ترین آیتم
+                for key in [key for key, (expires, _) in self.probe_cache.items() if expires <= now]:
+                    del self.probe_cache[key]
+                if len(self.probe_cache) >= self.probe_cache_size:
+                    del self.probe_cache[next(iter(self.probe_cache))]
+            self.probe_cache[url] = (now + self.probe_ttl, info)
+        return info
 
-    def download_instagram(self, url):
-        try:
-            ydl_opts = {
-                'outtmpl': os.path.join(self.download_path, '%(title)s.%(ext)s'),
-                'quiet': True,
-            }
+    def estimate_size(self, fmt, duration):
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if size:
+            return size
+        if fmt.get('tbr') and duration:
+            # tbr بر حسب کیلوبیت در ثانیه است
+            return int(fmt['tbr'] * 1000 / 8 * duration)
+        return None
+
+    def select_format(self, info, max_height=None):
+        """انتخاب بهترین فرمت تک‌فایلی که حجمش در محدودیت آپلود جا شود؛ خروجی (format_id, error)"""
+        duration = info.get('duration')
+        formats = [fmt for fmt in (info.get('formats') or [info]) if fmt.get('ext') != 'mhtml']
+
+        # فرمت‌هایی که صدا و تصویر را با هم دارند (بدون نیاز به ffmpeg برای ادغام)
+        progressive = [fmt for fmt in formats
+                       if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none']
+        video_only = [fmt for fmt in formats if fmt.get('vcodec') != 'none' and fmt.get('acodec') == 'none']
+        audio_only = [fmt for fmt in formats if fmt.get('vcodec') == 'none' and fmt.get('acodec') != 'none']
+        if not progressive and video_only and audio_only:
+            # بدون ادغام، خروجی ویدیوی بی‌صدا یا فقط صدا می‌شد
+            return self.select_merged_format(video_only, audio_only, duration, max_height)
+
+        candidates = progressive or formats
+        candidates.sort(key=lambda fmt: (fmt.get('height') or 0, fmt.get('tbr') or 0), reverse=True)
+
+        # پایین آمدن از بالاترین کیفیت مجاز تا اولین فرمتی که در محدودیت آپلود جا شود
+        allowed = [fmt for fmt in candidates if not max_height or (fmt.get('height') or 0) <= max_height]
+        for fmt in allowed:
+            size = self.estimate_size(fmt, duration)
+            # اگر حجم قابل تخمین نباشد، فرمت را رد نمی‌کنیم
+            if size is None or size <= self.max_upload_size:
+                return fmt.get('format_id'), None
+
+        # با ffmpeg کوچک‌ترین فرمت دانلود و بعد فشرده می‌شود
+        if self.postprocessor.enabled and allowed:
+            return min(allowed, key=lambda fmt: self.estimate_size(fmt, duration))['format_id'], None
+
+        limit_mb = self.max_upload_size // (1024 * 1024)
+        return None, f"حجم فایل حتی در کمترین کیفیت از محدودیت آپلود ({limit_mb}MB) بیشتر است"
+
+    def select_merged_format(self, video_only, audio_only, duration, max_height=None):
+        """انتخاب video+audio جدا برای ادغام با ffmpeg (معادل bv*+ba)؛ حجم تخمینی مجموع هر دو است"""
+        if not self.postprocessor.ffmpeg:
+            return None, "این ویدیو فایل تک‌تکه با صدا ندارد و ادغام صدا و تصویر روی سرور ممکن نیست"
+
+        audio = max(audio_only, key=lambda fmt: (fmt.get('abr') or fmt.get('tbr') or 0))
+        audio_size = self.estimate_size(audio, duration)
+        videos = sorted(video_only, key=lambda fmt: (fmt.get('height') or 0, fmt.get('tbr') or 0), reverse=True)
+        allowed = [fmt for fmt in videos if not max_height or (fmt.get('height') or 0) <= max_height]
+
+        def merged_size(fmt):
+            size = self.estimate_size(fmt, duration)
+            return size + audio_size if size is not None and audio_size is not None else None
+
+        for fmt in allowed:
+            size = merged_size(fmt)
+            if size is None or size <= self.max_upload_size:
+                return f"{fmt['format_id']}+{audio['format_id']}", None
+
+        if self.postprocessor.enabled and allowed:
+            fmt = min(allowed, key=merged_size)
+            return f"{fmt['format_id']}+{audio['format_id']}", None
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+        limit_mb = self.max_upload_size // (1024 * 1024)
+        return None, f"حجم فایل حتی در کمترین کیفیت از محدودیت آپلود ({limit_mb}MB) بیشتر است"
 
-                return filename, None
+    def download_with_probe(self, url, output_dir, max_height=None, priority=False, waited=0, progress=None):
+        info = self.probe(url)
 
+        if info.get('_type') in ('playlist', 'multi_video'):
+            return self.download_entries(url, info, output_dir, max_height, priority, waited, progress)
+
+        if not self.has_formats(info):
+            return None, "فایل قابل دانلودی برای این لینک پیدا نشد"
+
+        format_id, error = self.select_format(info, max_height)
+        if error:
+            return None, error
+
+        # رزرو فضا پیش از دانلود؛ فشرده‌سازی ffmpeg تا حجم آپلود فضای اضافه لازم دارد
+        error = self.staging.reserve(output_dir, self.reserve_size(info, format_id) or self.max_upload_size)
+        if error:
+            return None, error
+
+        platform = self.get_platform(url)
+        outtmpl = os.path.join(output_dir, '%(title)s.%(ext)s')
+        with self.bandwidth.share(priority, waited) as throttle:
+            # hook محدودیت پهنای باند آخر اجرا می‌شود چون ممکن است thread را نگه دارد
+            hooks = [progress, throttle] if progress else [throttle]
+            filename = self.run_download(platform, info, outtmpl, format_id, hooks, output_dir)
+
+        filename, error = self.postprocessor.process(filename, info.get('duration'))
+        self.staging.commit(output_dir, url, filename if not error else None)
+        return filename, error
+
+    def download_entries(self, url, info, output_dir, max_height=None, priority=False, waited=0, progress=None):
+        """دانلود هم‌زمان اعضای یک پست چندتایی (carousel)؛ خروجی (لیست MediaItem، error)"""
+        entries = [entry for entry in info.get('entries') or [] if entry]
+        skipped = [entry for entry in entries if not self.has_formats(entry)]
+        if skipped:
+            logging.warning(f"⚠️ Skipping {len(skipped)} items without downloadable formats in {url}")
+        entries = [entry for entry in entries if self.has_formats(entry)]
+        if not entries:
+            return None, "مدیایی در این پست پیدا نشد"
+
+        selected = []
+        for index, entry in enumerate(entries):
+            format_id, error = self.select_format(entry, max_height)
+            if error:
+                return None, error
+            media_id = str(entry.get('id') or '')
+            # شناسه تکراری یا خالی (مثلا شناسه خود پست) باعث نوشتن اعضا روی هم می‌شد
+            if not media_id or media_id in {item[0] for item in selected}:
+                media_id = f"{info.get('id')}_{index + 1}"
+            selected.append((media_id, entry, format_id))
+
+        # اعضایی که حجمشان معلوم نیست روی هم یک سهم حداکثر آپلود رزرو می‌کنند
+        sizes = [self.reserve_size(entry, format_id) for _, entry, format_id in selected]
+        estimate = sum(size for size in sizes if size) + (self.max_upload_size if None in sizes else 0)
+        error = self.staging.reserve(output_dir, estimate)
+        if error:
+            return None, error
+
+        platform = self.get_platform(url)
+        with self.bandwidth.share(priority, waited) as throttle:
+            hooks = [progress, throttle] if progress else [throttle]
+
+            def fetch(media_id, entry, format_id):
+                # نام فایل با شناسه عضو تا اعضای هم‌عنوان روی هم نوشته نشوند
+                outtmpl = os.path.join(output_dir, f"{media_id}.%(ext)s")
+                filename = self.run_download(platform, entry, outtmpl, format_id, hooks, output_dir)
+                filename, error = self.postprocessor.process(filename, entry.get('duration'))
+                return MediaItem(media_id, filename), error
+
+            futures = [self.entry_executor.submit(fetch, *item) for item in selected]
+            # منتظر همه می‌مانیم تا هیچ threadی پس از پاکسازی پوشه در آن ننویسد
+            wait(futures)
+            results = [future.result() for future in futures]
+
+        self.staging.commit(output_dir)
+        error = next((error for _, error in results if error), None)
+        if error:
+            return None, error
+        logging.info(f"📚 Downloaded {len(results)} items of {url}")
+        return [item for item, _ in results], None
+
+    def has_formats(self, info):
+        """probe با ignore_no_formats_error ممکن است عضوی بدون هیچ فرمت قابل دانلود برگرداند"""
+        return bool(info.get('formats') or info.get('url'))
+
+    def reserve_size(self, info, format_id):
+        """فضای لازم برای دانلود یک فرمت؛ فشرده‌سازی ffmpeg تا حجم آپلود فضای اضافه لازم دارد"""
+        estimate = 0
+        # برای video+audio جمع هر دو بخش، و فضای فایل ادغام شده
+        parts = str(format_id).split('+')
+        for part in parts:
+            fmt = next((fmt for fmt in info.get('formats') or [info] if str(fmt.get('format_id')) == part), {})
+            size = self.estimate_size(fmt, info.get('duration'))
+            if size is None:
+                return None
+            estimate += size
+        if len(parts) > 1:
+            estimate *= 2
+        if estimate and estimate > self.max_upload_size:
+            estimate += self.max_upload_size
+        return estimate
+
+    def run_download(self, platform, info, outtmpl, format_id, hooks, output_dir):
+        """دانلود از روی اطلاعات probe شده با ادامه فایل نیمه‌کاره پس از خطای گذرا؛ خروجی مسیر فایل"""
+        attempt = 0
+        while True:
+            try:
+                with self.ydl_pool.lease(platform, outtmpl=outtmpl, fmt=format_id, progress_hooks=hooks) as ydl:
+                    # استفاده از اطلاعات probe شده تا صفحه دوباره استخراج نشود
+                    result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                    return ydl.prepare_filename(result)
+            except load_yt_dlp().utils.DownloadError as e:
+                # اگر بخشی از فایل دریافت شده، تلاش بعدی از همان‌جا ادامه می‌دهد
+                if attempt >= self.resume_attempts or not self.has_partial(output_dir):
+                    raise
+                attempt += 1
+                DOWNLOAD_RESUMES.inc(platform=platform)
+                logging.warning(f"⚠️ Resuming partial download ({attempt}/{self.resume_attempts}): {e}")
+                time.sleep(self.resume_delay * attempt)
+
+    def has_partial(self, output_dir):
+        return any(name.endswith(('.part', '.ytdl')) for name in os.listdir(output_dir))
+
+    def thumbnail_for(self, file_path):
+        """مسیر تصویر بندانگشتی ساخته شده برای فایل، اگر وجود داشته باشد"""
+        thumbnail = self.postprocessor.thumbnail_path(file_path)
+        return thumbnail if os.path.exists(thumbnail) else None
+
+    def download_youtube(self, url, output_dir=None, priority=False, waited=0, progress=None):
+        output_dir = output_dir or self.download_path
+        try:
+            return self.download_with_probe(url, output_dir, self.youtube_max_height, priority, waited, progress)
+        except Exception as e:
+            return None, f"خطا در دانلود از یوتیوب: {str(e)}"
+
+    def download_instagram(self, url, output_dir=None, priority=False, waited=0, progress=None):
+        output_dir = output_dir or self.download_path
+        try:
+            return self.download_with_probe(url, output_dir, priority=priority, waited=waited, progress=progress)
         except Exception as e:
             return None, f"خطا در دانلود از اینستاگرام: {str(e)}"
 
@@ -67,4 +350,14 @@ class Downloader:
             if os.path.exists(file_path):
                 os.remove(file_path)
         except Exception as e:
-            logging.error(f"Cleanup error: {e}")
\ No newline at end of file
+            logging.error(f"Cleanup error: {e}")
+
+    def cleanup_dir(self, dir_path):
+        try:
+            self.staging.release(dir_path)
+        except Exception as e:
+            logging.error(f"Cleanup error: {e}")
+
+    def close(self):
+        self.entry_executor.shutdown(wait=False)
+        self.ydl_pool.close()
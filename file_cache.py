@@ -0,0 +1,144 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+# فقط این پلتفرم‌ها پست چندتایی (carousel) دارند
+GROUP_PLATFORMS = ('instagram',)
+
+
+class FileCache:
+    """کش file_id تلگرام با کلید (platform, media_id, format): LRU در حافظه جلوی جدول file_cache"""
+
+    def __init__(self, database=None):
+        self.db = database
+        self.max_size = int(os.environ.get('FILE_CACHE_SIZE', 1000))
+        self.entries = OrderedDict()
+        self.groups = OrderedDict()  # کلید پست چندتایی -> شناسه اعضا به ترتیب
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def db_available(self):
+        return self.db is not None and self.db.is_connected()
+
+    async def get(self, key):
+        with self.lock:
+            file_id = self.entries.get(key)
+            if file_id:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return file_id
+
+        file_id = await self.db.get_cached_file(*key) if self.db_available() else None
+        if file_id:
+            self.remember(key, file_id)
+            self.db_hits += 1
+        else:
+            self.misses += 1
+        return file_id
+
+    async def put(self, key, file_id):
+        self.remember(key, file_id)
+        if self.db_available():
+            await self.db.save_cached_file(*key, file_id)
+
+    async def get_media(self, key):
+        """file_id کش شده، یا لیست file_id ها اگر کلید یک پست چندتایی باشد
+
+        برخورد در حافظه بدون هیچ کوئری برمی‌گردد؛ جدول media_groups فقط برای پلتفرم‌های دارای carousel
+        و پس از خطای حافظه خوانده می‌شود.
+        """
+        with self.lock:
+            file_id = self.entries.get(key)
+            if file_id:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return file_id
+
+        if key[0] in GROUP_PLATFORMS:
+            file_ids = await self.get_group(key)
+            if file_ids:
+                return file_ids
+        return await self.get(key)
+
+    async def get_group(self, key):
+        """file_id های اعضای یک پست چندتایی؛ فقط اگر همه اعضا در کش باشند"""
+        with self.lock:
+            item_ids = self.groups.get(key)
+            if item_ids:
+                self.groups.move_to_end(key)
+        if not item_ids and self.db_available():
+            item_ids = await self.db.get_media_group(*key)
+            if item_ids:
+                self.remember_group(key, item_ids)
+        if not item_ids:
+            return None
+
+        file_ids = []
+        for item_id in item_ids:
+            file_id = await self.get((key[0], item_id, key[2]))
+            if not file_id:
+                return None
+            file_ids.append(file_id)
+        return file_ids
+
+    async def put_group(self, key, items):
+        """ثبت یک پست چندتایی؛ items لیست (item_id, file_id) است و هر عضو با کلید خودش کش می‌شود"""
+        for item_id, file_id in items:
+            await self.put((key[0], item_id, key[2]), file_id)
+        item_ids = [item_id for item_id, _ in items]
+        self.remember_group(key, item_ids)
+        if self.db_available():
+            await self.db.save_media_group(*key, item_ids)
+
+    async def put_media(self, key, media, file_id):
+        """ثبت نتیجه آپلود خروجی download_media؛ برای پست چندتایی media لیست MediaItem و file_id لیست است"""
+        if not isinstance(media, list):
+            await self.put(key, file_id)
+        elif all(file_id):
+            await self.put_group(key, [(item.media_id, item_file_id) for item, item_file_id in zip(media, file_id)])
+
+    def remember_group(self, key, item_ids):
+        with self.lock:
+            self.groups[key] = item_ids
+            self.groups.move_to_end(key)
+            while len(self.groups) > self.max_size:
+                self.groups.popitem(last=False)
+
+    def remember(self, key, file_id):
+        with self.lock:
+            self.entries[key] = file_id
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    async def invalidate(self, key=None):
+        """حذف یک کلید، یا کل کش اگر کلیدی داده نشود"""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                self.groups.clear()
+            else:
+                self.entries.pop(key, None)
+                self.groups.pop(key, None)
+
+        if self.db_available():
+            if key is None:
+                await self.db.clear_file_cache()
+            else:
+                await self.db.delete_cached_file(*key)
+        logging.info(f"🗑️ File cache invalidated: {key or 'all'}")
+
+    def stats(self):
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            'size': len(self.entries),
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'hit_rate': (hits / total * 100) if total else 0.0,
+        }
@@ -0,0 +1,59 @@
+import asyncio
+
+
+class Flight:
+    """یک دانلود در جریان که چند درخواست هم‌زمان برای یک مدیا در آن شریک هستند"""
+
+    def __init__(self, key):
+        loop = asyncio.get_running_loop()
+        self.key = key
+        self.refs = 0
+        self.result = loop.create_future()  # (file_path, error) خروجی دانلود
+        self.file_id = loop.create_future()  # file_id اولین آپلود موفق یا None
+        self.output_dir = None
+        self.progress = []  # ProgressMessage درخواست‌هایی که منتظر این دانلود هستند
+
+    def report(self, status):
+        """progress hook دانلود؛ پیشرفت برای همه درخواست‌های شریک نمایش داده می‌شود"""
+        for message in list(self.progress):
+            message.hook(status)
+
+    def finish(self, file_path=None, error=None, file_id=None):
+        """تکمیل futureهای باقی‌مانده تا هیچ درخواست منتظری معلق نماند"""
+        if not self.result.done():
+            self.result.set_result((file_path, error))
+        if not self.file_id.done():
+            self.file_id.set_result(file_id)
+
+
+class InflightRegistry:
+    """single-flight: برای هر کلید مدیا فقط یک دانلود اجرا می‌شود و فایل با شمارش ارجاع پاکسازی می‌شود"""
+
+    def __init__(self, cleanup):
+        self.flights = {}
+        self.cleanup = cleanup
+
+    def acquire(self, key):
+        """پیوستن به دانلود در جریان این کلید یا شروع یک دانلود جدید؛ خروجی (flight, leader)"""
+        flight = self.flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = Flight(key)
+            self.flights[key] = flight
+        flight.refs += 1
+        return flight, leader
+
+    def discard(self, flight):
+        """خارج کردن flight از ثبت تا درخواست‌های بعدی به آن نپیوندند (مثلا وقتی وارد صف نشد)"""
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def release(self, flight):
+        flight.refs -= 1
+        if flight.refs > 0:
+            return
+
+        self.discard(flight)
+        # آخرین درخواست فایل را پاک می‌کند، نه اولین
+        if flight.output_dir:
+            self.cleanup(flight.output_dir)
@@ -0,0 +1,282 @@
+import os
+import time
+import signal
+import socket
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from database import Database, AsyncDatabase
+from downloader import Downloader
+from file_cache import FileCache
+from write_buffer import WriteBehindBuffer
+from url_parser import parse_link
+from uploader import Uploader, local_mode_enabled
+from progress import ProgressReporter
+from metrics import MetricsServer, REQUESTS, UPLOAD_SECONDS, UPLOADED_BYTES
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+
+class JobWorker:
+    """پروسه کارگر حالت چند پروسه‌ای: کارهای جدول download_jobs را برمی‌دارد، دانلود و برای کاربر ارسال می‌کند
+
+    هر تعداد از این پروسه روی هر تعداد ماشین می‌تواند اجرا شود؛ کار با FOR UPDATE SKIP LOCKED برداشته می‌شود
+    و اگر heartbeat ورکری بیش از JOB_VISIBILITY_TIMEOUT قطع شود، کارش به ورکر دیگری می‌رسد (تحویل حداقل یک‌بار).
+    """
+
+    def __init__(self):
+        self.token = os.environ.get('TELEGRAM_BOT_TOKEN')
+        if not self.token:
+            raise ValueError("❌ لطفا TELEGRAM_BOT_TOKEN را تنظیم کنید")
+
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = int(os.environ.get('JOB_WORKER_CONCURRENCY', os.environ.get('DOWNLOAD_WORKERS', 4)))
+        self.poll_interval = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+        self.heartbeat_interval = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+        self.visibility_timeout = float(os.environ.get('JOB_VISIBILITY_TIMEOUT', 60))
+        self.max_attempts = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+        self.retention = float(os.environ.get('JOB_RETENTION', 86400))
+        self.next_prune = 0
+
+        self.db = AsyncDatabase(Database())
+        if not self.db.is_connected():
+            logging.warning("⚠️ Database connection failed, will keep retrying")
+
+        self.downloader = Downloader()
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job')
+        self.file_cache = FileCache(self.db)
+        self.write_buffer = WriteBehindBuffer(self.db)
+        self.metrics_server = MetricsServer()
+        self.uploader = Uploader()
+        self.progress = ProgressReporter()
+
+        # Bot پیش‌فرض فقط یک اتصال HTTP دارد؛ هر ورکر هم‌زمان به اتصال خودش نیاز دارد
+        request = HTTPXRequest(connection_pool_size=self.concurrency * 2)
+        api_url = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
+        if api_url:
+            self.bot = Bot(self.token, base_url=f"{api_url}/bot", base_file_url=f"{api_url}/file/bot",
+                           request=request, local_mode=local_mode_enabled())
+        else:
+            self.bot = Bot(self.token, request=request)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        async with self.bot:
+            await self.metrics_server.start()
+            await self.write_buffer.start()
+            tasks = [asyncio.create_task(self.claim_loop()) for _ in range(self.concurrency)]
+            logging.info(f"✅ Job worker {self.worker_id} started with {self.concurrency} slots")
+
+            await stop.wait()
+
+            # کارهای نیمه‌کاره به صف برمی‌گردند تا ورکر دیگری آن‌ها را انجام دهد
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.write_buffer.stop()
+            await self.metrics_server.stop()
+
+        self.downloader.close()
+        self.executor.shutdown(wait=False)
+        self.db.close()
+
+    async def claim_loop(self):
+        while True:
+            try:
+                job = await self.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Job claim error: {e}")
+                job = None
+
+            if job:
+                await self.process(job)
+                continue
+
+            if time.monotonic() >= self.next_prune:
+                self.next_prune = time.monotonic() + 3600
+                await self.db.prune_download_jobs(self.retention)
+            await asyncio.sleep(self.poll_interval)
+
+    async def claim(self):
+        claim = asyncio.ensure_future(self.db.claim_download_job(self.worker_id, self.visibility_timeout))
+        try:
+            return await asyncio.shield(claim)
+        except asyncio.CancelledError:
+            # کوئری در thread ادامه دارد؛ کاری که برداشته شود بدون انتظار برای انقضای heartbeat به صف برمی‌گردد
+            try:
+                job = await claim
+            except Exception:
+                job = None
+            if job:
+                await self.db.requeue_download_job(job['job_id'], self.worker_id)
+            raise
+
+    async def heartbeat(self, job, delivery, lost):
+        """تمدید مالکیت تا پایان کار؛ اگر کار واقعا به ورکر دیگری رسیده باشد، ارسال این ورکر لغو می‌شود"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                owned = await self.db.heartbeat_download_job(job['job_id'], self.worker_id)
+            except Exception as e:
+                logging.error(f"Heartbeat error: {e}")
+                owned = None
+            if owned is None:
+                # خطای گذرای دیتابیس؛ مالکیت هنوز از دست نرفته و در نوبت بعد دوباره تمدید می‌شود
+                logging.warning(f"⚠️ Heartbeat failed for download job {job['job_id']}, retrying")
+                continue
+            if not owned:
+                logging.warning(f"⚠️ Lost ownership of download job {job['job_id']}, cancelling")
+                lost.set()
+                delivery.cancel()
+                return
+
+    async def process(self, job):
+        lost = asyncio.Event()
+        heartbeat = None
+        try:
+            if job['attempts'] > self.max_attempts:
+                await self.edit_status(job, "❌ دانلود پس از چند تلاش ناموفق بود. لطفا دوباره تلاش کنید.")
+                await self.db.finish_download_job(job['job_id'], self.worker_id, 'failed', 'max attempts exceeded')
+                return
+
+            started = time.monotonic()
+            link = parse_link(job['url'])
+            platform = link.platform if link else 'generic'
+            # ارسال در task جدا تا heartbeat بتواند فقط همین کار را لغو کند
+            delivery = asyncio.create_task(self.deliver(job, link))
+            heartbeat = asyncio.create_task(self.heartbeat(job, delivery, lost))
+            try:
+                status, size, cache_hit, error = await delivery
+            except asyncio.CancelledError:
+                if not lost.is_set():
+                    raise
+                # ورکر دیگری کار را برداشته و نتیجه را خودش ثبت می‌کند
+                return
+
+            REQUESTS.inc(platform=platform, status=status, cache_hit=str(cache_hit).lower())
+            duration_ms = int((time.monotonic() - started) * 1000)
+            self.write_buffer.record_download(job['user_id'], platform, size, duration_ms, cache_hit, status)
+            await self.db.finish_download_job(job['job_id'], self.worker_id,
+                                              'done' if status == 'success' else 'failed', error)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.db.requeue_download_job(job['job_id'], self.worker_id))
+            raise
+        except Exception as e:
+            logging.error(f"Download job {job['job_id']} error: {e}")
+            await self.db.finish_download_job(job['job_id'], self.worker_id, 'failed', str(e))
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+
+    async def deliver(self, job, link):
+        """دانلود و ارسال یک کار؛ خروجی (status, bytes, cache_hit, error)"""
+        media_key = self.downloader.get_media_key(link) if link else None
+
+        # ممکن است ورکر دیگری همین مدیا را در این فاصله آپلود کرده باشد
+        if media_key:
+            file_id = await self.file_cache.get_media(media_key)
+            if file_id:
+                try:
+                    await self.send_document(job, file_id)
+                    await self.delete_status(job)
+                    return 'success', 0, True, None
+                except Exception as e:
+                    logging.warning(f"Cached file_id rejected for {media_key}: {e}")
+                    await self.file_cache.invalidate(media_key)
+
+        await self.edit_status(job, "⏳ در حال پردازش لینک...")
+        output_dir = self.downloader.create_job_dir(f"job-{job['job_id']}")
+        progress = self.track_progress(job)
+        loop = asyncio.get_running_loop()
+        try:
+            file_path, error = await loop.run_in_executor(
+                self.executor, self.downloader.download_media, job['url'], output_dir,
+                bool(job['priority']), job['waited'], progress.hook
+            )
+            if error:
+                progress.close()
+                await self.edit_status(job, f"❌ {error}")
+                return 'failed', 0, False, error
+
+            size = self.downloader.media_size(file_path)
+            started = time.perf_counter()
+            try:
+                # پست‌های چندتایی در دسته‌های media group ارسال می‌شوند
+                file_id = await self.uploader.send_media(
+                    self.bot, job['chat_id'], file_path,
+                    caption="✅ دانلود با موفقیت انجام شد",
+                    thumbnail_for=self.downloader.thumbnail_for,
+                    progress=progress.upload
+                )
+            except Exception as e:
+                UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome='failed')
+                progress.close()
+                await self.edit_status(job, f"❌ خطا در ارسال فایل: {str(e)}")
+                return 'failed', 0, False, str(e)
+
+            UPLOAD_SECONDS.observe(time.perf_counter() - started, outcome='success')
+            UPLOADED_BYTES.inc(size)
+            if media_key and file_id:
+                try:
+                    await self.file_cache.put_media(media_key, file_path, file_id)
+                except Exception as e:
+                    # فایل ارسال شده؛ خطای کش نباید کار را ناموفق کند و فایل دوباره ارسال شود
+                    logging.error(f"File cache write error: {e}")
+            progress.close()
+            await self.delete_status(job)
+            return 'success', size, False, None
+        finally:
+            progress.close()
+            self.downloader.cleanup_dir(output_dir)
+
+    def track_progress(self, job):
+        async def edit(text):
+            await self.bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['status_message_id'])
+
+        progress = self.progress.track(job['chat_id'], edit, "⏳ در حال پردازش لینک...")
+        if not job['status_message_id']:
+            progress.close()
+        return progress
+
+    async def send_document(self, job, document):
+        return await self.uploader.send_file_id(
+            self.bot,
+            job['chat_id'],
+            document,
+            caption="✅ دانلود با موفقیت انجام شد"
+        )
+
+    async def edit_status(self, job, text):
+        if not job['status_message_id']:
+            return
+        try:
+            await self.bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['status_message_id'])
+        except Exception as e:
+            logging.warning(f"Status message edit error: {e}")
+
+    async def delete_status(self, job):
+        if not job['status_message_id']:
+            return
+        try:
+            await self.bot.delete_message(chat_id=job['chat_id'], message_id=job['status_message_id'])
+        except Exception as e:
+            logging.warning(f"Status message delete error: {e}")
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(JobWorker().run())
+    except Exception as e:
+        logging.error(f"❌ Failed to start job worker: {e}")
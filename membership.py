@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatMemberStatus
+
+MEMBER_STATUSES = {
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.ADMINISTRATOR,
+    ChatMemberStatus.OWNER,
+}
+
+
+class MembershipGate:
+    """بررسی عضویت اجباری در کانال‌ها با کش TTL نتیجه get_chat_member برای هر کاربر"""
+
+    def __init__(self, database):
+        self.db = database
+        self.ttl = float(os.environ.get('MEMBERSHIP_CACHE_TTL', 300))
+        self.cache_size = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', 10000))
+        self.cache = {}  # user_id -> (expires_at, کانال‌هایی که کاربر عضوشان نیست)
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(user_id, None)
+
+    async def missing_channels(self, bot, user_id):
+        """کانال‌هایی که کاربر هنوز عضو آن‌ها نشده است"""
+        cached = self.cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        channels = await self.db.get_forced_channels()
+        if not channels:
+            return []
+
+        # یک دور درخواست هم‌زمان برای همه کانال‌ها
+        results = await asyncio.gather(*(self.is_member(bot, channel, user_id) for channel in channels))
+        missing = [channel for channel, member in zip(channels, results) if not member]
+
+        if len(self.cache) >= self.cache_size:
+            now = time.monotonic()
+            for key in [key for key, (expires, _) in self.cache.items() if expires <= now]:
+                del self.cache[key]
+            if len(self.cache) >= self.cache_size:
+                del self.cache[next(iter(self.cache))]
+        self.cache[user_id] = (time.monotonic() + self.ttl, missing)
+        return missing
+
+    async def is_member(self, bot, channel, user_id):
+        chat_id = channel['channel_id'] or channel['channel_username']
+        try:
+            member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+        except Exception as e:
+            # اگر ربات به کانال دسترسی ندارد، کاربران را به خاطر تنظیم اشتباه مسدود نمی‌کنیم
+            logging.error(f"Membership check error for {chat_id}: {e}")
+            return True
+
+        if member.status in MEMBER_STATUSES:
+            return True
+        return member.status == ChatMemberStatus.RESTRICTED and getattr(member, 'is_member', False)
+
+    def join_keyboard(self, channels):
+        keyboard = []
+        for channel in channels:
+            username = (channel['channel_username'] or '').lstrip('@')
+            if username:
+                title = channel['channel_title'] or f"@{username}"
+                keyboard.append([InlineKeyboardButton(f"📢 {title}", url=f"https://t.me/{username}")])
+        keyboard.append([InlineKeyboardButton("✅ عضو شدم", callback_data="check_membership")])
+        return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,289 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Metric):
+    """گیج با مقدار ثابت یا تابعی که هنگام خواندن صدا زده می‌شود"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def set_function(self, function, **labels):
+        with self.lock:
+            self.functions[self.key(labels)] = function
+
+    def collect(self):
+        lines = self.header()
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logging.error(f"Gauge {self.name} callback error: {e}")
+        for key, value in values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        lines = self.header()
+        with self.lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = format_labels(self.labelnames, key, [('le', bound)])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PROBE_SECONDS = REGISTRY.register(Histogram(
+    'bot_probe_seconds', 'Metadata probe (extract_info without download) latency', ['platform']))
+PROBE_CACHE = REGISTRY.register(Counter(
+    'bot_probe_cache_total', 'Probe cache lookups', ['result']))
+DOWNLOAD_SECONDS = REGISTRY.register(Histogram(
+    'bot_download_seconds', 'Download latency inside a worker', ['platform', 'outcome']))
+UPLOAD_SECONDS = REGISTRY.register(Histogram(
+    'bot_upload_seconds', 'send_document latency for downloaded files', ['outcome']))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'bot_queue_wait_seconds', 'Time a download job waited for a worker'))
+DB_SECONDS = REGISTRY.register(Histogram(
+    'bot_db_seconds', 'Database method latency including pool wait', ['method']))
+DB_ERRORS = REGISTRY.register(Counter(
+    'bot_db_errors_total', 'Failed database queries'))
+REQUESTS = REGISTRY.register(Counter(
+    'bot_requests_total', 'Download requests by platform and outcome', ['platform', 'status', 'cache_hit']))
+DOWNLOADED_BYTES = REGISTRY.register(Counter(
+    'bot_downloaded_bytes_total', 'Bytes fetched from source platforms', ['platform']))
+UPLOADED_BYTES = REGISTRY.register(Counter(
+    'bot_uploaded_bytes_total', 'Bytes uploaded to Telegram'))
+POSTPROCESS_SECONDS = REGISTRY.register(Histogram(
+    'bot_postprocess_seconds', 'ffmpeg post-processing latency', ['operation']))
+STAGING_BYTES = REGISTRY.register(Gauge(
+    'bot_staging_bytes', 'Bytes reserved or used in the download staging area'))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_queue_depth', 'Download jobs waiting for a worker'))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'bot_in_flight', 'Work currently in progress', ['kind']))
+BANDWIDTH_ALLOCATED = REGISTRY.register(Gauge(
+    'bot_bandwidth_allocated_bytes', 'Download bandwidth currently allocated to active jobs (bytes/s)'))
+DOWNLOAD_RESUMES = REGISTRY.register(Counter(
+    'bot_download_resumes_total', 'Downloads resumed from a partial file after an error', ['platform']))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'bot_startup_seconds', 'Seconds from process start until each startup phase finished', ['phase']))
+
+
+def process_age():
+    """ثانیه‌های گذشته از شروع پروسه (شامل بالا آمدن مفسر)؛ روی سیستم‌های بدون /proc خروجی None"""
+    try:
+        with open('/proc/self/stat') as file:
+            start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as file:
+            uptime = float(file.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    """زمان‌بندی مراحل راه‌اندازی از شروع پروسه برای پایش cold start
+
+    هر مرحله در متریک bot_startup_seconds ثبت می‌شود و report خلاصه را در لاگ می‌نویسد؛
+    اگر آماده شدن برای پاسخ به آپدیت‌ها بیش از STARTUP_TARGET ثانیه طول بکشد هشدار داده می‌شود.
+    برای جزئیات importها: python -X importtime bot.py
+    """
+
+    def __init__(self):
+        self.target = float(os.environ.get('STARTUP_TARGET', 3))
+        self.started = time.perf_counter() - (process_age() or 0)
+        self.phases = {}
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        self.phases[phase] = time.perf_counter() - self.started
+        STARTUP_SECONDS.set(round(self.phases[phase], 3), phase=phase)
+
+    def report(self, ready_phase=None):
+        phases = ' '.join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+        ready = self.phases.get(ready_phase)
+        if ready is not None and ready > self.target:
+            logging.warning(f"🐢 Startup took {ready:.2f}s (target {self.target:.1f}s): {phases}")
+        else:
+            logging.info(f"🚀 Startup profile: {phases}")
+
+
+class RequestTrace:
+    """زمان‌بندی مراحل یک درخواست؛ فقط اگر TRACE_REQUESTS فعال باشد در لاگ نوشته می‌شود"""
+
+    enabled = os.environ.get('TRACE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+
+    def mark(self, phase, at=None):
+        now = at if at is not None else time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def finish(self, status):
+        if not self.enabled:
+            return
+        total = (time.perf_counter() - self.started) * 1000
+        phases = ' '.join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in self.phases)
+        logging.info(f"⏱️ trace {self.name} status={status} total={total:.0f}ms {phases}")
+
+
+class MetricsServer:
+    """سرور HTTP ساده روی پورت جانبی برای /metrics در قالب متنی Prometheus"""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self.port = int(os.environ.get('METRICS_PORT', 9090))
+        self.host = os.environ.get('METRICS_HOST', '0.0.0.0')
+        self.server = None
+
+    async def start(self):
+        if self.port <= 0:
+            return
+        try:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            logging.info(f"✅ Metrics endpoint listening on {self.host}:{self.port}/metrics")
+        except OSError as e:
+            logging.error(f"❌ Metrics server error: {e}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # خواندن و رد کردن هدرها
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logging.debug(f"Metrics request error: {e}")
+        finally:
+            writer.close()
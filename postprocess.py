@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import logging
+import threading
+import subprocess
+
+from metrics import POSTPROCESS_SECONDS
+
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mov', '.mkv', '.webm'}
+FASTSTART_EXTENSIONS = {'.mp4', '.m4v', '.mov'}
+
+# حداکثر ارتفاع تصویر برای هر بازه بیت‌ریت ویدیو هنگام فشرده‌سازی
+HEIGHT_FOR_BITRATE = ((1500_000, 720), (800_000, 480), (400_000, 360), (0, 240))
+
+
+def enabled_flag(name, default='true'):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+class PostProcessor:
+    """پردازش فایل دانلود شده با ffmpeg: فشرده‌سازی تا محدودیت آپلود، faststart و تصویر بندانگشتی
+
+    در thread دانلود اجرا می‌شود (نه event loop)؛ ffmpeg خودش پروسه جداگانه است و
+    POSTPROCESS_WORKERS تعداد پروسه‌های هم‌زمان آن را محدود می‌کند. اگر ffmpeg نصب نباشد غیرفعال است.
+    """
+
+    def __init__(self, max_upload_size):
+        self.max_upload_size = max_upload_size
+        self.ffmpeg = os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg')
+        self.ffprobe = os.environ.get('FFPROBE_PATH') or shutil.which('ffprobe')
+        self.enabled = bool(self.ffmpeg) and enabled_flag('POSTPROCESS_ENABLED')
+        self.faststart = enabled_flag('POSTPROCESS_FASTSTART')
+        self.thumbnails = enabled_flag('POSTPROCESS_THUMBNAILS')
+        self.timeout = float(os.environ.get('POSTPROCESS_TIMEOUT', 900))
+        self.audio_bitrate = int(os.environ.get('POSTPROCESS_AUDIO_BITRATE', 128_000))
+        self.min_video_bitrate = int(os.environ.get('POSTPROCESS_MIN_VIDEO_BITRATE', 150_000))
+        self.slots = threading.BoundedSemaphore(int(os.environ.get('POSTPROCESS_WORKERS', os.cpu_count() or 1)))
+
+        if not self.ffmpeg:
+            logging.info("ℹ️ ffmpeg not found, post-processing disabled")
+
+    def run(self, operation, args):
+        with self.slots, POSTPROCESS_SECONDS.time(operation=operation):
+            result = subprocess.run(
+                [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', *args],
+                capture_output=True, timeout=self.timeout
+            )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode(errors='replace').strip()[-500:])
+
+    def duration(self, file_path):
+        if not self.ffprobe:
+            return None
+        result = subprocess.run(
+            [self.ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', file_path],
+            capture_output=True, timeout=60
+        )
+        try:
+            return float(json.loads(result.stdout)['format']['duration'])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def thumbnail_path(self, file_path):
+        return f"{os.path.splitext(file_path)[0]}.thumb.jpg"
+
+    def process(self, file_path, duration=None):
+        """خروجی (file_path, error)؛ فایل بزرگ‌تر از محدودیت آپلود در صورت امکان کوچک می‌شود"""
+        if not self.enabled:
+            return file_path, None
+
+        size = os.path.getsize(file_path)
+        extension = os.path.splitext(file_path)[1].lower()
+        try:
+            if size > self.max_upload_size:
+                duration = duration or self.duration(file_path)
+                file_path, error = self.shrink(file_path, duration)
+                if error:
+                    return None, error
+            elif self.faststart and extension in FASTSTART_EXTENSIONS:
+                self.remux_faststart(file_path)
+        except Exception as e:
+            logging.error(f"Post-processing error: {e}")
+            if size > self.max_upload_size:
+                return None, self.size_error()
+
+        if self.thumbnails and os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS:
+            try:
+                self.make_thumbnail(file_path, duration)
+            except Exception as e:
+                logging.warning(f"Thumbnail error: {e}")
+        return file_path, None
+
+    def size_error(self):
+        limit_mb = self.max_upload_size // (1024 * 1024)
+        return f"حجم فایل حتی پس از فشرده‌سازی از محدودیت آپلود ({limit_mb}MB) بیشتر است"
+
+    def shrink(self, file_path, duration):
+        """فشرده‌سازی با بیت‌ریت هدف؛ اگر ویدیو در محدودیت جا نشود فقط صدا استخراج می‌شود"""
+        if not duration:
+            return None, self.size_error()
+
+        stem = os.path.splitext(file_path)[0]
+        # ۵٪ حاشیه برای سربار container
+        total_bitrate = int(self.max_upload_size * 8 * 0.95 / duration)
+        video_bitrate = total_bitrate - self.audio_bitrate
+
+        if video_bitrate >= self.min_video_bitrate:
+            height = next(height for bitrate, height in HEIGHT_FOR_BITRATE if video_bitrate >= bitrate)
+            output = f"{stem}.small.mp4"
+            self.run('transcode', [
+                '-i', file_path,
+                '-c:v', 'libx264', '-preset', 'veryfast',
+                '-b:v', str(video_bitrate), '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2),
+                '-vf', f"scale=-2:'min({height},ih)'",
+                '-c:a', 'aac', '-b:a', str(self.audio_bitrate),
+                '-movflags', '+faststart',
+                output,
+            ])
+            if os.path.getsize(output) <= self.max_upload_size:
+                os.remove(file_path)
+                return output, None
+            os.remove(output)
+
+        audio_bitrate = min(self.audio_bitrate, total_bitrate)
+        if audio_bitrate < 32_000:
+            return None, self.size_error()
+
+        output = f"{stem}.m4a"
+        self.run('audio', ['-i', file_path, '-vn', '-c:a', 'aac', '-b:a', str(audio_bitrate), output])
+        if os.path.getsize(output) <= self.max_upload_size:
+            os.remove(file_path)
+            return output, None
+        os.remove(output)
+        return None, self.size_error()
+
+    def remux_faststart(self, file_path):
+        """انتقال moov به ابتدای فایل بدون encode مجدد تا پخش پیش از دانلود کامل شروع شود"""
+        stem, extension = os.path.splitext(file_path)
+        output = f"{stem}.faststart{extension}"
+        try:
+            self.run('faststart', ['-i', file_path, '-map', '0', '-c', 'copy', '-movflags', '+faststart', output])
+            os.replace(output, file_path)
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+
+    def make_thumbnail(self, file_path, duration=None):
+        # تلگرام تصویر JPEG حداکثر 320 پیکسل و کمتر از 200KB می‌پذیرد
+        offset = min(1.0, duration / 2) if duration else 0
+        self.run('thumbnail', [
+            '-ss', str(offset), '-i', file_path,
+            '-frames:v', '1', '-vf', 'scale=320:320:force_original_aspect_ratio=decrease', '-q:v', '5',
+            self.thumbnail_path(file_path),
+        ])
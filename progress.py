@@ -0,0 +1,140 @@
+import os
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, BadRequest
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.2f}GB"
+
+
+def download_text(status):
+    """متن پیشرفت از وضعیت progress hook در yt-dlp؛ برای وضعیت‌های غیر از downloading خروجی None"""
+    if status.get('status') != 'downloading':
+        return None
+    done = status.get('downloaded_bytes') or 0
+    total = status.get('total_bytes') or status.get('total_bytes_estimate')
+    parts = [f"{min(100, int(done * 100 / total))}%" if total else format_size(done)]
+    if status.get('speed'):
+        parts.append(f"{format_size(status['speed'])}/s")
+    eta = status.get('eta')
+    if total and eta is not None:
+        parts.append(f"⏱ {int(eta) // 60}:{int(eta) % 60:02d}")
+    return "⬇️ در حال دانلود... " + " • ".join(parts)
+
+
+def upload_text(sent, total):
+    return f"⬆️ در حال ارسال فایل... {min(100, int(sent * 100 / total)) if total else 0}%"
+
+
+class ProgressMessage:
+    """پیام وضعیت یک درخواست که با پیشرفت دانلود و آپلود ویرایش می‌شود
+
+    hook و upload از هر threadی قابل صدا زدن هستند؛ فقط آخرین متن نگه داشته و در event loop ارسال می‌شود.
+    پیش از ویرایش یا حذف نهایی پیام باید close صدا زده شود تا ویرایش در انتظاری روی متن نهایی ننشیند.
+    """
+
+    def __init__(self, reporter, chat_id, edit, text=None):
+        self.reporter = reporter
+        self.chat_id = chat_id
+        self.edit = edit  # coroutine function که متن جدید را روی پیام می‌نشاند
+        self.loop = asyncio.get_running_loop()
+        self.last_text = text
+        self.pending = None
+        self.task = None
+        self.closed = False
+        self.last_report = 0
+
+    def report(self, text, force=False):
+        # از thread دانلود: ارسال به event loop حداکثر هر report_interval ثانیه
+        now = time.monotonic()
+        if self.closed or not text or (not force and now - self.last_report < self.reporter.report_interval):
+            return
+        self.last_report = now
+        try:
+            self.loop.call_soon_threadsafe(self.update, text)
+        except RuntimeError:
+            pass  # event loop بسته شده است
+
+    def hook(self, status):
+        """progress hook برای YoutubeDL"""
+        try:
+            self.report(download_text(status))
+        except Exception as e:
+            logging.warning(f"Progress hook error: {e}")
+
+    def upload(self, sent, total):
+        self.report(upload_text(sent, total), force=sent == 0)
+
+    def update(self, text):
+        if self.closed or text == self.last_text:
+            return
+        self.pending = text
+        if self.task is None:
+            self.task = self.loop.create_task(self.flush())
+
+    async def flush(self):
+        try:
+            while self.pending and not self.closed:
+                # پیام‌های یک چت به نوبت (FIFO) ویرایش می‌شوند تا یکی بقیه را از سهم چت محروم نکند
+                async with self.reporter.lock(self.chat_id):
+                    delay = self.reporter.next_edit.get(self.chat_id, 0) - time.monotonic()
+                    if delay > 0:
+                        # متن‌های رسیده در این فاصله با هم ادغام می‌شوند و فقط آخرین ارسال می‌شود
+                        await asyncio.sleep(delay)
+
+                    text, self.pending = self.pending, None
+                    if not text or text == self.last_text or self.closed:
+                        continue
+                    self.reporter.next_edit[self.chat_id] = time.monotonic() + self.reporter.interval
+                    try:
+                        await self.edit(text)
+                        self.last_text = text
+                    except RetryAfter as e:
+                        self.reporter.next_edit[self.chat_id] = time.monotonic() + e.retry_after
+                        self.pending = self.pending or text
+                    except BadRequest as e:
+                        # مثلا "message is not modified" یا پیام حذف شده
+                        logging.debug(f"Progress edit skipped: {e}")
+                    except Exception as e:
+                        logging.warning(f"Progress edit error: {e}")
+        finally:
+            self.task = None
+
+    def close(self):
+        self.closed = True
+        self.pending = None
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+class ProgressReporter:
+    """محدودیت ویرایش پیام‌های پیشرفت برای هر چت: حداکثر یک ویرایش در هر PROGRESS_EDIT_INTERVAL ثانیه"""
+
+    def __init__(self):
+        self.interval = float(os.environ.get('PROGRESS_EDIT_INTERVAL', 3))
+        self.report_interval = min(1.0, self.interval)
+        self.enabled = self.interval > 0
+        self.next_edit = {}  # chat_id -> زمان مجاز ویرایش بعدی (monotonic)
+        self.locks = {}  # chat_id -> asyncio.Lock
+
+    def lock(self, chat_id):
+        return self.locks.setdefault(chat_id, asyncio.Lock())
+
+    def track(self, chat_id, edit, text=None):
+        if len(self.next_edit) > 1000:
+            now = time.monotonic()
+            self.next_edit = {chat: at for chat, at in self.next_edit.items() if at > now}
+            # قفل آزاد هم تا پایان فاصله ویرایش چت نگه داشته می‌شود؛ پیامی که تازه بیدار شده ممکن است
+            # هنوز آن را نگرفته باشد و قفل تازه دو پیام یک چت را از هم جدا و محدودیت چت را بی‌اثر می‌کرد
+            self.locks = {chat: lock for chat, lock in self.locks.items()
+                          if lock.locked() or chat in self.next_edit}
+        message = ProgressMessage(self, chat_id, edit, text)
+        message.closed = not self.enabled
+        return message
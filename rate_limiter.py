@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """محدودکننده نرخ token bucket: rate توکن در ثانیه با ظرفیت انفجاری capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """گرفتن توکن بدون انتظار؛ اگر توکن کافی نباشد False"""
+        if time.monotonic() < self.paused_until:
+            return False
+        self.refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens=1):
+        """چند ثانیه تا در دسترس بودن توکن کافی"""
+        self.refill()
+        paused = max(0.0, self.paused_until - time.monotonic())
+        return max(paused, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        async with self.lock:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                self.refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """توقف کامل صدور توکن، مثلا پس از دریافت RetryAfter از تلگرام"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class UserRateLimiter:
+    """یک token bucket جدا برای هر کاربر"""
+
+    def __init__(self, rate, capacity, max_users=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_users = max_users
+        self.buckets = {}
+
+    def allow(self, user_id):
+        """خروجی (allowed, retry_after)"""
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            if len(self.buckets) >= self.max_users:
+                self.prune()
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.capacity)
+
+        if bucket.try_acquire():
+            return True, 0
+        return False, bucket.wait_time()
+
+    def prune(self):
+        """حذف bucketهای پر؛ کاربری که bucketش پر است با bucket تازه هم تفاوتی نمی‌بیند"""
+        for user_id in list(self.buckets):
+            bucket = self.buckets[user_id]
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[user_id]
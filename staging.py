@@ -0,0 +1,212 @@
+import os
+import re
+import time
+import shutil
+import socket
+import logging
+import threading
+from collections import OrderedDict
+
+from metrics import STAGING_BYTES
+
+AREA_PATTERN = re.compile(r'^area-(?P<host>.+)-(?P<pid>\d+)$')
+
+
+def dir_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+def last_modified(path):
+    """آخرین تغییر یک پوشه area یا کارهای داخل آن"""
+    latest = os.path.getmtime(path)
+    for entry in os.scandir(path):
+        try:
+            latest = max(latest, entry.stat(follow_symlinks=False).st_mtime)
+        except OSError:
+            pass
+    return latest
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StagingArea:
+    """فضای موقت دانلودها با سقف حجم: پذیرش با رزرو فضا، نگهداری کوتاه فایل‌های تمام شده و حذف LRU
+
+    هر پروسه پوشه area-<host>-<pid> خودش را دارد تا هنگام شروع، پوشه‌های پروسه‌های مرده پاک شوند.
+    hostname کانتینر با هر ری‌استارت عوض می‌شود، پس area ماشین دیگری که بیش از STAGING_ORPHAN_AGE ثانیه
+    تغییری نداشته هم یتیم حساب می‌شود.
+    متدها از threadهای دانلود صدا زده می‌شوند.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.budget = int(os.environ.get('STAGING_BUDGET', 2 * 1024 * 1024 * 1024))
+        self.retention = float(os.environ.get('STAGING_RETENTION', 0))
+        self.wait_timeout = float(os.environ.get('STAGING_WAIT_TIMEOUT', 30))
+        # باید از طولانی‌ترین دانلود و STAGING_RETENTION بیشتر باشد
+        self.orphan_age = float(os.environ.get('STAGING_ORPHAN_AGE', 6 * 3600))
+        self.sweep_interval = min(float(os.environ.get('STAGING_SWEEP_INTERVAL', 3600)), self.orphan_age / 2)
+        self.host = socket.gethostname()
+        self.area = os.path.join(root, f"area-{self.host}-{os.getpid()}")
+
+        self.condition = threading.Condition()
+        self.usage = {}  # job_dir -> حجم رزرو شده یا واقعی
+        self.files = {}  # job_dir -> (url, file_path) برای کارهای موفق
+        self.retained = OrderedDict()  # url -> (job_dir, file_path, expires_at) به ترتیب LRU
+
+        os.makedirs(root, exist_ok=True)
+        # پوشه همین pid فقط اگر pid تکراری باشد وجود دارد؛ بقیه در پس‌زمینه پاک می‌شوند تا شروع ربات معطل نشود
+        shutil.rmtree(self.area, ignore_errors=True)
+        os.makedirs(self.area, exist_ok=True)
+        threading.Thread(target=self.sweep_loop, name='staging-sweep', daemon=True).start()
+        STAGING_BYTES.set_function(self.used)
+
+    def used(self):
+        return sum(self.usage.values())
+
+    def sweep_loop(self):
+        """پاکسازی دوره‌ای؛ area پروسه‌ای که روی ماشین دیگری crash کرده پس از STAGING_ORPHAN_AGE حذف می‌شود"""
+        while True:
+            try:
+                # area همین پروسه حتی در بیکاری تازه می‌ماند تا نمونه‌های ماشین‌های دیگر آن را یتیم ندانند
+                os.makedirs(self.area, exist_ok=True)
+                os.utime(self.area)
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Staging sweep error: {e}")
+            time.sleep(self.sweep_interval)
+
+    def sweep(self):
+        """حذف باقی‌مانده اجراهای قبلی؛ پوشه پروسه‌های زنده و area های فعال ماشین‌های دیگر دست نمی‌خورند"""
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path == self.area:
+                continue
+            match = AREA_PATTERN.match(name) if os.path.isdir(path) else None
+            try:
+                if match:
+                    if match.group('host') == self.host:
+                        if pid_alive(int(match.group('pid'))):
+                            continue
+                    elif time.time() - last_modified(path) < self.orphan_age:
+                        # وضعیت پروسه ماشین دیگر معلوم نیست؛ فقط area بدون تغییر طولانی یتیم است
+                        continue
+
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError as e:
+                logging.error(f"Staging sweep error for {path}: {e}")
+        if removed:
+            logging.info(f"🧹 Removed {removed} orphaned staging entries")
+
+    def create(self, job_id):
+        job_dir = os.path.join(self.area, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        with self.condition:
+            self.usage[job_dir] = 0
+        return job_dir
+
+    def reserve(self, job_dir, size):
+        """رزرو فضا برای دانلود؛ تا STAGING_WAIT_TIMEOUT منتظر آزاد شدن فضا می‌ماند و در غیر این صورت پیام خطا"""
+        if job_dir not in self.usage:
+            return None
+        if size > self.budget:
+            return "حجم فایل از فضای موقت سرور بیشتر است"
+
+        deadline = time.monotonic() + self.wait_timeout
+        with self.condition:
+            while True:
+                self.expire()
+                free = self.budget - self.used() + self.usage.get(job_dir, 0)
+                if size <= free:
+                    self.usage[job_dir] = max(self.usage.get(job_dir, 0), size)
+                    return None
+                if self.evict_oldest():
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return "فضای دیسک سرور پر است. لطفا چند دقیقه دیگر تلاش کنید."
+                self.condition.wait(remaining)
+
+    def commit(self, job_dir, url=None, file_path=None):
+        """ثبت حجم واقعی پس از دانلود؛ فایل موفق برای بازاستفاده در درخواست‌های تکراری علامت می‌خورد"""
+        size = dir_size(job_dir)
+        with self.condition:
+            if job_dir not in self.usage:
+                return
+            self.usage[job_dir] = size
+            if url and file_path:
+                self.files[job_dir] = (url, file_path)
+            self.condition.notify_all()
+
+    def release(self, job_dir):
+        """پایان کار یک پوشه: یا برای STAGING_RETENTION ثانیه نگه داشته می‌شود یا بلافاصله حذف"""
+        with self.condition:
+            self.expire()
+            entry = self.files.pop(job_dir, None)
+            if self.retention > 0 and entry and os.path.exists(entry[1]):
+                url, file_path = entry
+                previous = self.retained.pop(url, None)
+                self.retained[url] = (job_dir, file_path, time.monotonic() + self.retention)
+                if previous is None or previous[0] == job_dir:
+                    return
+                job_dir = previous[0]
+            self.usage.pop(job_dir, None)
+            self.condition.notify_all()
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    def reuse(self, url, job_dir):
+        """اگر فایل همین لینک هنوز نگه داشته شده، با hard link در پوشه کار جدید قرار می‌گیرد"""
+        with self.condition:
+            entry = self.retained.get(url) if job_dir in self.usage else None
+            if not entry or entry[2] <= time.monotonic() or not os.path.exists(entry[1]):
+                return None
+            self.retained.move_to_end(url)
+            source_dir, file_path = entry[0], entry[1]
+            try:
+                for name in os.listdir(source_dir):
+                    target = os.path.join(job_dir, name)
+                    try:
+                        os.link(os.path.join(source_dir, name), target)
+                    except OSError:
+                        shutil.copy2(os.path.join(source_dir, name), target)
+            except OSError as e:
+                logging.warning(f"Staging reuse error: {e}")
+                return None
+        return os.path.join(job_dir, os.path.basename(file_path))
+
+    def expire(self):
+        now = time.monotonic()
+        for url in [url for url, (_, _, expires) in self.retained.items() if expires <= now]:
+            self.drop(url)
+
+    def evict_oldest(self):
+        if not self.retained:
+            return False
+        self.drop(next(iter(self.retained)))
+        return True
+
+    def drop(self, url):
+        job_dir, _, _ = self.retained.pop(url)
+        self.usage.pop(job_dir, None)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        self.condition.notify_all()
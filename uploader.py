@@ -0,0 +1,228 @@
+import os
+from pathlib import Path
+from contextlib import ExitStack
+from telegram import InputFile, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+from postprocess import VIDEO_EXTENSIONS
+
+# سرور Bot API محلی (telegram-bot-api --local) فایل‌ها را مستقیم از دیسک می‌خواند و تا 2000MB می‌پذیرد
+LOCAL_MAX_UPLOAD_SIZE = 2000 * 1024 * 1024
+CLOUD_MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+# حداکثر تعداد فایل در یک sendMediaGroup
+MEDIA_GROUP_SIZE = 10
+# عکس‌ها با sendPhoto فقط تا 10MB پذیرفته می‌شوند
+PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+PHOTO_MAX_SIZE = 10 * 1024 * 1024
+
+
+def media_kind(file_path):
+    """نوع عضو media group بر اساس پسوند فایل"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in PHOTO_EXTENSIONS and os.path.getsize(file_path) <= PHOTO_MAX_SIZE:
+        return 'photo'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return 'document'
+
+
+def group_file_id(message):
+    """file_id عضو ارسال شده همراه با نوعش (مثل photo:ID)؛ ارسال دوباره از کش به نوع عضو نیاز دارد"""
+    if message.photo:
+        return f"photo:{message.photo[-1].file_id}"
+    if message.video:
+        return f"video:{message.video.file_id}"
+    return message.document.file_id if message.document else None
+
+
+def parse_group_file_id(file_id):
+    """خروجی (kind, file_id)؛ file_id بدون پیشوند (کش قدیمی) سند است"""
+    kind, separator, value = file_id.partition(':')
+    return (kind, value) if separator else ('document', file_id)
+
+
+def input_media(kind, media, thumbnail=None):
+    if kind == 'photo':
+        # عکس thumbnail جدا نمی‌پذیرد
+        return InputMediaPhoto(media)
+    if kind == 'video':
+        return InputMediaVideo(media, thumbnail=thumbnail, supports_streaming=True)
+    return InputMediaDocument(media, thumbnail=thumbnail)
+
+
+def local_mode_enabled():
+    """حالت local فقط همراه با TELEGRAM_API_URL معنی دارد"""
+    enabled = os.environ.get('TELEGRAM_LOCAL_MODE', 'false').lower() in ('1', 'true', 'yes')
+    return enabled and bool(os.environ.get('TELEGRAM_API_URL'))
+
+
+def default_max_upload_size():
+    return LOCAL_MAX_UPLOAD_SIZE if local_mode_enabled() else CLOUD_MAX_UPLOAD_SIZE
+
+
+class ProgressReader:
+    """فایل باز با گزارش بایت‌های خوانده شده؛ httpx هنگام ساخت بدنه multipart از آن می‌خواند"""
+
+    def __init__(self, file, progress):
+        self.file = file
+        self.progress = progress
+        self.total = os.fstat(file.fileno()).st_size
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        self.progress(self.file.tell(), self.total)
+        return chunk
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    @property
+    def name(self):
+        return self.file.name
+
+
+class StreamingInputFile(InputFile):
+    """InputFile بدون خواندن کل فایل در حافظه؛ httpx فایل را تکه‌های 64KB از دیسک می‌فرستد"""
+
+    __slots__ = ('file',)
+
+    def __init__(self, file, filename=None, attach=False):
+        # attach برای فایل‌های داخل media group که با attach://name ارجاع داده می‌شوند
+        super().__init__(b'', filename=filename or os.path.basename(file.name), attach=attach)
+        self.file = file
+
+    @property
+    def field_tuple(self):
+        return self.filename, self.file, self.mimetype
+
+
+class Uploader:
+    """ارسال فایل دانلود شده از دیسک
+
+    در حالت local فقط مسیر فایل (file://) فرستاده می‌شود و سرور Bot API خودش فایل را می‌خواند؛
+    پوشه downloads باید با همین مسیر برای آن سرور قابل دسترس باشد. در غیر این صورت بدنه multipart
+    به صورت جریانی از فایل باز ساخته می‌شود و حافظه مصرفی هر آپلود به اندازه یک تکه است.
+    """
+
+    def __init__(self):
+        self.timeout = float(os.environ.get('UPLOAD_TIMEOUT', 300))
+
+    async def send_document(self, bot, chat_id, file_path, caption=None, thumbnail_path=None, progress=None):
+        """progress در صورت وجود با (sent, total) هنگام ارسال بدنه صدا زده می‌شود"""
+        thumbnail = Path(thumbnail_path) if thumbnail_path else None
+        if bot.local_mode:
+            return await bot.send_document(
+                chat_id=chat_id,
+                document=Path(file_path).absolute(),
+                caption=caption,
+                thumbnail=thumbnail,
+                read_timeout=self.timeout,
+                write_timeout=self.timeout
+            )
+
+        with open(file_path, 'rb') as file:
+            return await bot.send_document(
+                chat_id=chat_id,
+                document=StreamingInputFile(ProgressReader(file, progress) if progress else file),
+                caption=caption,
+                thumbnail=thumbnail,
+                read_timeout=self.timeout,
+                write_timeout=self.timeout
+            )
+
+    async def send_media(self, bot, chat_id, media, caption=None, thumbnail_for=None, progress=None):
+        """ارسال خروجی download_media؛ خروجی file_id، یا لیست file_id ها برای پست چندتایی"""
+        thumbnail_for = thumbnail_for or (lambda _: None)
+        if isinstance(media, list):
+            paths = [item.file_path for item in media]
+            return await self.send_media_group(bot, chat_id, paths, caption,
+                                               [thumbnail_for(path) for path in paths], progress)
+
+        sent = await self.send_document(bot, chat_id, media, caption, thumbnail_for(media), progress)
+        return sent.document.file_id if sent.document else None
+
+    async def send_file_id(self, bot, chat_id, file_id, caption=None):
+        """ارسال دوباره با file_id کش شده؛ برای پست چندتایی لیست file_id ها"""
+        if isinstance(file_id, list):
+            return await self.send_cached_group(bot, chat_id, file_id, caption)
+        # عضو کش شده پست چندتایی با پیشوند نوعش ذخیره شده و ممکن است با کلید یک پست تکی یکی باشد
+        kind, file_id = parse_group_file_id(file_id)
+        return await getattr(bot, f'send_{kind}')(chat_id, file_id, caption=caption)
+
+    def batches(self, items):
+        """تقسیم به دسته‌های حداکثر MEDIA_GROUP_SIZE تایی؛ media group حداقل دو عضو لازم دارد"""
+        batches = [items[i:i + MEDIA_GROUP_SIZE] for i in range(0, len(items), MEDIA_GROUP_SIZE)]
+        if len(batches) > 1 and len(batches[-1]) == 1:
+            batches[-1].insert(0, batches[-2].pop())
+        return batches
+
+    async def send_media_group(self, bot, chat_id, file_paths, caption=None, thumbnail_paths=None, progress=None):
+        """ارسال چند فایل در دسته‌های sendMediaGroup؛ خروجی لیست file_id به ترتیب file_paths
+
+        progress با مجموع بایت‌های ارسال شده همه فایل‌ها صدا زده می‌شود. کپشن فقط روی دسته اول می‌نشیند.
+        """
+        if len(file_paths) == 1:
+            sent = await self.send_document(bot, chat_id, file_paths[0], caption,
+                                            thumbnail_paths[0] if thumbnail_paths else None, progress)
+            return [sent.document.file_id if sent.document else None]
+
+        thumbnail_paths = thumbnail_paths or [None] * len(file_paths)
+        total = sum(os.path.getsize(path) for path in file_paths)
+        offset = 0
+        file_ids = []
+        for batch in self.batches(list(zip(file_paths, thumbnail_paths))):
+            # عکس و ویدیو در یک آلبوم کنار هم می‌نشینند، ولی سند فقط با سند؛ با یک سند کل دسته سند می‌شود
+            kinds = [media_kind(file_path) for file_path, _ in batch]
+            if 'document' in kinds:
+                kinds = ['document'] * len(batch)
+
+            with ExitStack() as stack:
+                media = []
+                for (file_path, thumbnail_path), kind in zip(batch, kinds):
+                    if kind == 'photo':
+                        thumbnail_path = None
+                    if bot.local_mode:
+                        media.append(input_media(
+                            kind,
+                            Path(file_path).absolute(),
+                            thumbnail=Path(thumbnail_path).absolute() if thumbnail_path else None
+                        ))
+                        continue
+
+                    file = stack.enter_context(open(file_path, 'rb'))
+                    if progress:
+                        file = ProgressReader(file, lambda sent, _, base=offset: progress(base + sent, total))
+                    thumbnail = None
+                    if thumbnail_path:
+                        thumbnail = StreamingInputFile(stack.enter_context(open(thumbnail_path, 'rb')), attach=True)
+                    media.append(input_media(kind, StreamingInputFile(file, attach=True), thumbnail=thumbnail))
+                    offset += os.path.getsize(file_path)
+
+                messages = await bot.send_media_group(
+                    chat_id=chat_id,
+                    media=media,
+                    caption=caption if not file_ids else None,
+                    read_timeout=self.timeout,
+                    write_timeout=self.timeout
+                )
+            file_ids.extend(group_file_id(message) for message in messages)
+        return file_ids
+
+    async def send_cached_group(self, bot, chat_id, file_ids, caption=None):
+        """ارسال دوباره چند فایل با file_id های کش شده (با پیشوند نوع عضو)"""
+        if len(file_ids) == 1:
+            return await self.send_file_id(bot, chat_id, file_ids[0], caption)
+
+        sent = False
+        for batch in self.batches(list(file_ids)):
+            await bot.send_media_group(
+                chat_id=chat_id,
+                media=[input_media(*parse_group_file_id(file_id)) for file_id in batch],
+                caption=caption if not sent else None
+            )
+            sent = True
@@ -0,0 +1,67 @@
+import re
+from collections import namedtuple
+
+# یک الگوی از پیش کامپایل شده برای همه لینک‌های پشتیبانی شده؛ هر شاخه گروه نام‌دار خودش را دارد
+# شناسه 11 کاراکتری یوتیوب باید همان‌جا تمام شود تا شناسه بلندتر به ویدیوی دیگری نگاشت نشود.
+# بخش‌هایی مثل reels/audio/<id> صفحه مدیا نیستند و شناسه به حساب نمی‌آیند.
+LINK_PATTERN = re.compile(r"""
+    (?<![\w.-])
+    (?:https?://)?
+    (?:
+        (?:www\.|m\.|music\.)?youtube\.com/
+        (?:
+            watch\?\S*?\bv=(?P<yt_watch>[\w-]{11})(?![\w-])
+          | (?:shorts|embed|live|v)/(?P<yt_path>[\w-]{11})(?![\w-])
+          | playlist\?\S*?\blist=(?P<yt_list>[\w-]+)
+        )
+      | youtu\.be/(?P<yt_short>[\w-]{11})(?![\w-])
+      | (?:www\.|m\.)?instagram\.com/(?:[\w.]+/)?(?P<ig_kind>p|reels?|tv)/
+        (?!(?:audio|explore|tags|locations)(?![\w-]))(?P<ig_code>[\w-]+)
+    )
+""", re.IGNORECASE | re.VERBOSE)
+
+IG_KINDS = {'p': 'post', 'reel': 'reel', 'reels': 'reel', 'tv': 'tv'}
+
+
+class MediaLink(namedtuple('MediaLink', ['platform', 'kind', 'media_id'])):
+    """کلید استاندارد یک لینک: (platform, kind, media_id)"""
+    __slots__ = ()
+
+    @property
+    def url(self):
+        """آدرس استاندارد، مستقل از شکل لینکی که کاربر فرستاده"""
+        if self.platform == 'youtube':
+            if self.kind == 'playlist':
+                return f"https://www.youtube.com/playlist?list={self.media_id}"
+            return f"https://www.youtube.com/watch?v={self.media_id}"
+        path = {'post': 'p', 'reel': 'reel', 'tv': 'tv'}[self.kind]
+        return f"https://www.instagram.com/{path}/{self.media_id}/"
+
+
+def link_from_match(match):
+    groups = match.groupdict()
+    if groups['yt_watch'] or groups['yt_path'] or groups['yt_short']:
+        return MediaLink('youtube', 'video', groups['yt_watch'] or groups['yt_path'] or groups['yt_short'])
+    if groups['yt_list']:
+        return MediaLink('youtube', 'playlist', groups['yt_list'])
+    return MediaLink('instagram', IG_KINDS[groups['ig_kind'].lower()], groups['ig_code'])
+
+
+def extract_links(text, limit=None):
+    """همه لینک‌های پشتیبانی شده داخل متن، بدون تکرار و به ترتیب ظاهر شدن"""
+    links = []
+    seen = set()
+    for match in LINK_PATTERN.finditer(text or ''):
+        link = link_from_match(match)
+        if link in seen:
+            continue
+        seen.add(link)
+        links.append(link)
+        if limit and len(links) >= limit:
+            break
+    return links
+
+
+def parse_link(url):
+    links = extract_links(url, limit=1)
+    return links[0] if links else None
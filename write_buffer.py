@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+
+class WriteBehindBuffer:
+    """بافر نوشتن تاخیری: upsert کاربران و شمارنده دانلودها در حافظه جمع و به صورت دسته‌ای در دیتابیس نوشته می‌شوند"""
+
+    def __init__(self, database):
+        self.db = database
+        self.flush_interval = float(os.environ.get('WRITE_BUFFER_INTERVAL', 5))
+        self.max_pending = int(os.environ.get('WRITE_BUFFER_MAX', 500))
+        # سقف هر یک از کاربران، شمارنده‌ها و رویدادهای نگه داشته شده وقتی دیتابیس مدت طولانی در دسترس نیست
+        self.max_retained = int(os.environ.get('WRITE_BUFFER_RETAIN', 50000))
+        # پس از فلاش ناموفق، تلاش بعدی با فاصله دو برابر شونده تا این سقف
+        self.max_backoff = float(os.environ.get('WRITE_BUFFER_MAX_BACKOFF', 60))
+        self.backoff = 0
+        self.retry_at = 0
+
+        self.users = {}  # user_id -> (username, first_name, last_name)؛ آخرین مقدار برنده است
+        self.counters = {}  # user_id -> تعداد دانلودهای ثبت نشده
+        self.events = []  # رویدادهای دانلود ثبت نشده
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.pending_flush = None
+
+    def pending_count(self):
+        return len(self.users) + len(self.counters) + len(self.events)
+
+    def add_user(self, user_id, username, first_name, last_name):
+        self.users[user_id] = (username, first_name, last_name)
+        self.check_threshold()
+
+    def increment_download_count(self, user_id, delta=1):
+        self.counters[user_id] = self.counters.get(user_id, 0) + delta
+        self.check_threshold()
+
+    def record_download(self, user_id, platform, size, duration_ms, cache_hit, status):
+        """ثبت یک رویداد دانلود؛ دانلودهای موفق شمارنده کاربر را هم افزایش می‌دهند"""
+        created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.events.append((user_id, platform, size, duration_ms, cache_hit, status, created_at))
+        if status == 'success':
+            self.increment_download_count(user_id)
+        else:
+            self.check_threshold()
+
+    def check_threshold(self):
+        if self.pending_count() >= self.max_pending and self.flush_due():
+            self.pending_flush = asyncio.create_task(self.flush())
+
+    def flush_due(self):
+        """فقط یک فلاش در جریان، و بعد از خطا نه پیش از پایان backoff"""
+        if self.flush_lock.locked() or (self.pending_flush and not self.pending_flush.done()):
+            return False
+        return time.monotonic() >= self.retry_at
+
+    async def start(self):
+        self.flush_task = asyncio.create_task(self.flush_periodically())
+
+    async def stop(self):
+        """توقف فلاش دوره‌ای و نوشتن هر چه در بافر مانده"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+        if self.pending_flush:
+            await asyncio.gather(self.pending_flush, return_exceptions=True)
+        await self.flush()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.flush_due():
+                await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.users and not self.counters and not self.events:
+                return
+
+            users, self.users = self.users, {}
+            counters, self.counters = self.counters, {}
+            events, self.events = self.events, []
+
+            success = False
+            try:
+                success = await self.db.flush_writes(users, counters, events)
+            except Exception as e:
+                logging.error(f"❌ Write buffer flush error: {e}")
+
+            if success:
+                self.backoff = 0
+                self.retry_at = 0
+                return
+
+            # برگرداندن داده‌ها به بافر بدون بازنویسی مقادیر جدیدتر؛ داده‌های قدیمی‌تر اول می‌آیند تا اول حذف شوند
+            self.users = {**users, **self.users}
+            for user_id, delta in self.counters.items():
+                counters[user_id] = counters.get(user_id, 0) + delta
+            self.counters = counters
+            self.events[:0] = events
+            self.trim()
+
+            self.backoff = min(self.max_backoff, self.backoff * 2 or self.flush_interval)
+            self.retry_at = time.monotonic() + self.backoff
+            logging.warning(f"⚠️ Write buffer flush failed, {self.pending_count()} writes kept for retry "
+                            f"in {self.backoff:.0f}s")
+
+    def trim(self):
+        """حذف قدیمی‌ترین داده‌های بیش از max_retained در هر بخش بافر"""
+        if len(self.events) > self.max_retained:
+            dropped = len(self.events) - self.max_retained
+            del self.events[:dropped]
+            logging.error(f"❌ Write buffer full, dropped {dropped} oldest download events")
+        for name, pending in (('user upserts', self.users), ('download counters', self.counters)):
+            if len(pending) > self.max_retained:
+                dropped = len(pending) - self.max_retained
+                for key in list(pending)[:dropped]:
+                    del pending[key]
+                logging.error(f"❌ Write buffer full, dropped {dropped} oldest {name}")
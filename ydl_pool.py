@@ -0,0 +1,241 @@
+import os
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+_yt_dlp = None
+
+
+def load_yt_dlp():
+    """import تاخیری yt_dlp تا شروع ربات منتظر بارگذاری extractorها نماند"""
+    global _yt_dlp
+    if _yt_dlp is None:
+        import yt_dlp
+        _yt_dlp = yt_dlp
+    return _yt_dlp
+
+
+_instagram_extractor = None
+
+
+def instagram_extractor():
+    """InstagramIE که عکس‌های پست چندتایی را هم با یک فرمت تصویر برمی‌گرداند
+
+    extractor اصلی اعضای عکس را یا رد می‌کند (sidecar) یا بدون فرمت برمی‌گرداند (API)؛
+    با همان ie_key ثبت می‌شود تا جای extractor اصلی را بگیرد.
+    """
+    global _instagram_extractor
+    if _instagram_extractor is None:
+        load_yt_dlp()
+        from yt_dlp.extractor.instagram import InstagramIE, _pk_to_id
+        from yt_dlp.utils import determine_ext, int_or_none, traverse_obj
+
+        def image_info(media_id, candidates):
+            candidates = [candidate for candidate in candidates if candidate.get('url')]
+            if not candidates:
+                return {}
+            best = max(candidates, key=lambda candidate: (
+                (int_or_none(candidate.get('width')) or 0) * (int_or_none(candidate.get('height')) or 0)))
+            return {
+                'id': media_id,
+                'formats': [{
+                    'format_id': 'image',
+                    'url': best['url'],
+                    'ext': determine_ext(best['url'], 'jpg'),
+                    'width': int_or_none(best.get('width')),
+                    'height': int_or_none(best.get('height')),
+                    'vcodec': 'none',
+                    'acodec': 'none',
+                }],
+            }
+
+        class InstagramMediaIE(InstagramIE):
+            IE_NAME = InstagramIE.IE_NAME
+
+            @classmethod
+            def ie_key(cls):
+                return InstagramIE.ie_key()
+
+            def _extract_product_media(self, product_media):
+                info = super()._extract_product_media(product_media)
+                if info:
+                    return info
+                return image_info(
+                    product_media.get('code') or _pk_to_id(product_media.get('pk')),
+                    traverse_obj(product_media, ('image_versions2', 'candidates')) or [])
+
+            def _extract_nodes(self, nodes, is_direct=False):
+                for index, node in enumerate(nodes, start=1):
+                    if not is_direct or node.get('__typename') == 'GraphVideo' or node.get('is_video') is True:
+                        for info in super()._extract_nodes([node], is_direct):
+                            yield {**info, 'title': node.get('title') or (f'Video {index}' if is_direct else None)}
+                        continue
+
+                    candidates = [{
+                        'url': resource.get('src'),
+                        'width': resource.get('config_width'),
+                        'height': resource.get('config_height'),
+                    } for resource in node.get('display_resources') or []]
+                    info = image_info(node.get('shortcode') or node.get('id'), candidates or [{
+                        'url': node.get('display_url'),
+                        **(node.get('dimensions') or {}),
+                    }])
+                    if info:
+                        yield {
+                            **info,
+                            'title': f'Image {index}',
+                            'http_headers': {'Referer': 'https://www.instagram.com/'},
+                        }
+
+        _instagram_extractor = InstagramMediaIE
+    return _instagram_extractor
+
+
+class PooledYoutubeDL:
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.created_at = time.monotonic()
+        self.uses = 0
+
+
+class YoutubeDLPool:
+    """استخر نمونه‌های YoutubeDL برای هر پلتفرم؛ extractorها، cookie jar و نشست HTTP بین درخواست‌ها حفظ می‌شوند"""
+
+    def __init__(self):
+        self.size = int(os.environ.get('YDL_POOL_SIZE', os.environ.get('DOWNLOAD_WORKERS', 4)))
+        self.max_uses = int(os.environ.get('YDL_MAX_USES', 200))
+        self.max_age = float(os.environ.get('YDL_MAX_AGE', 1800))
+        self.acquire_timeout = float(os.environ.get('YDL_ACQUIRE_TIMEOUT', 300))
+        self.base_params = {
+            'quiet': True,
+            'noplaylist': True,
+            # چند fragment هم‌زمان برای DASH/HLS و دانلود بازه‌ای فایل‌های progressive
+            'concurrent_fragment_downloads': int(os.environ.get('DOWNLOAD_FRAGMENTS', 4)),
+            'http_chunk_size': int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 10 * 1024 * 1024)),
+            'retries': int(os.environ.get('DOWNLOAD_RETRIES', 5)),
+            'fragment_retries': int(os.environ.get('DOWNLOAD_RETRIES', 5)),
+            # فایل .part نیمه‌کاره در تلاش بعدی ادامه داده می‌شود
+            'continuedl': True,
+            # خروجی ادغام video+audio؛ mp4 در تلگرام مستقیم پخش می‌شود
+            'merge_output_format': 'mp4',
+        }
+        if os.environ.get('FFMPEG_PATH'):
+            self.base_params['ffmpeg_location'] = os.environ['FFMPEG_PATH']
+
+        self.idle = {}  # platform -> LifoQueue از نمونه‌های آزاد
+        self.created = {}  # platform -> تعداد نمونه‌های ساخته شده
+        self.cookiejars = {}  # platform -> cookie jar مشترک
+        self.lock = threading.Lock()
+
+    def build(self, platform):
+        yt_dlp = load_yt_dlp()
+        params = dict(self.base_params)
+        cookie_file = os.environ.get(f'YDL_COOKIES_{platform.upper()}')
+        if cookie_file:
+            params['cookiefile'] = cookie_file
+
+        ydl = yt_dlp.YoutubeDL.__new__(yt_dlp.YoutubeDL)
+        jar = self.cookiejars.get(platform)
+        if jar is not None:
+            # cookiejar در YoutubeDL یک cached_property است؛ مقداردهی پیش از __init__ باعث می‌شود
+            # request handlerهای این نمونه هم از همان jar مشترک استفاده کنند
+            ydl.__dict__['cookiejar'] = jar
+        ydl.__init__(params)
+        if platform == 'instagram':
+            # جایگزینی extractor اصلی در همان جایگاه با نسخه‌ای که اعضای عکس را هم دارد
+            ydl.add_info_extractor(instagram_extractor()())
+        self.cookiejars.setdefault(platform, ydl.cookiejar)
+        return PooledYoutubeDL(ydl)
+
+    def acquire(self, platform):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self.lock:
+                idle = self.idle.setdefault(platform, queue.LifoQueue())
+                try:
+                    return idle.get_nowait()
+                except queue.Empty:
+                    pass
+                create = self.created.get(platform, 0) < self.size
+                if create:
+                    self.created[platform] = self.created.get(platform, 0) + 1
+
+            if create:
+                try:
+                    return self.build(platform)
+                except Exception:
+                    with self.lock:
+                        self.created[platform] -= 1
+                    raise
+
+            # انتظار کوتاه و بررسی دوباره، چون نمونه‌های دور انداخته شده ظرفیت آزاد می‌کنند
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"no YoutubeDL instance available for {platform}")
+            try:
+                return idle.get(timeout=min(remaining, 1))
+            except queue.Empty:
+                continue
+
+    def warmup(self, platforms):
+        """ساخت یک نمونه برای هر پلتفرم پیش از اولین درخواست (import و بارگذاری extractorها)"""
+        for platform in platforms:
+            self.release(platform, self.acquire(platform))
+
+    def release(self, platform, worker):
+        worker.uses += 1
+        expired = worker.uses >= self.max_uses or time.monotonic() - worker.created_at >= self.max_age
+        if expired:
+            # بازسازی دوره‌ای برای جلوگیری از رشد حافظه و نشست‌های کهنه
+            self.discard(platform, worker)
+        else:
+            self.idle[platform].put(worker)
+
+    def discard(self, platform, worker):
+        with self.lock:
+            self.created[platform] -= 1
+        try:
+            worker.ydl.close()
+        except Exception as e:
+            logging.error(f"YoutubeDL close error: {e}")
+
+    def configure(self, ydl, outtmpl=None, fmt=None, progress_hooks=None, probe=False):
+        """اعمال تنظیمات مخصوص هر کار روی یک نمونه مشترک"""
+        ydl.params['outtmpl'] = {'default': outtmpl} if outtmpl else {}
+        ydl._parse_outtmpl()
+        # probe فقط اطلاعات می‌خواهد؛ عضوی که فرمت مناسب پیش‌فرض ندارد نباید کل پست را خراب کند
+        ydl.params['ignore_no_formats_error'] = probe
+        ydl.params['format'] = fmt
+        ydl.format_selector = ydl.build_format_selector(fmt) if fmt else None
+        # hookهای کار قبلی نباید روی این نمونه باقی بمانند
+        ydl._progress_hooks = list(progress_hooks or [])
+
+    @contextmanager
+    def lease(self, platform, outtmpl=None, fmt=None, progress_hooks=None, probe=False):
+        worker = self.acquire(platform)
+        try:
+            self.configure(worker.ydl, outtmpl, fmt, progress_hooks, probe)
+            yield worker.ydl
+        except Exception as e:
+            if isinstance(e, load_yt_dlp().utils.DownloadError):
+                # خطای عادی استخراج/دانلود؛ نمونه سالم است
+                self.release(platform, worker)
+            else:
+                # نمونه‌ای که خطای غیرمنتظره داده ممکن است وضعیت نامعتبر داشته باشد
+                self.discard(platform, worker)
+            raise
+        else:
+            self.release(platform, worker)
+
+    def close(self):
+        with self.lock:
+            queues = list(self.idle.items())
+        for platform, idle in queues:
+            while True:
+                try:
+                    worker = idle.get_nowait()
+                except queue.Empty:
+                    break
+                self.discard(platform, worker)